@@ -0,0 +1,110 @@
+"""
+Микробатчинг эмбеддингов запросов: вопросы одновременных пользователей собираются
+в течение нескольких миллисекунд (или до max_batch штук) и отправляются одним запросом
+к embeddings API; каждый ожидающий получает свой вектор.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Callable, Optional
+
+from .metrics import observe
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+WAIT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class EmbeddingBatcher:
+    """
+    Очередь запросов на эмбеддинг с фоновым обработчиком в текущем event loop.
+    embed_many — синхронная функция list[str] -> list[vector]; вызывается в отдельном потоке,
+    чтобы не блокировать loop.
+    """
+
+    def __init__(
+        self,
+        embed_many: Callable[[list[str]], list[list[float]]],
+        max_batch: int = 16,
+        max_wait_ms: float = 5.0,
+    ):
+        self.embed_many = embed_many
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._inflight: set[asyncio.Task] = set()
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        loop = asyncio.get_running_loop()
+        # Новый event loop (перезапуск приложения, бенчмарк) — своя очередь и свой обработчик
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            # Пустой контекст: обработчик не должен наследовать трейс запроса, который его запустил
+            self._worker = contextvars.Context().run(
+                loop.create_task, self._run(self._queue), name="embedding-batcher"
+            )
+        return self._queue
+
+    async def embed(self, text: str) -> list[float]:
+        """Эмбеддинг одного текста; запрос к API разделяется с другими ожидающими."""
+        future = asyncio.get_running_loop().create_future()
+        self._ensure_worker().put_nowait((text, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> list[tuple]:
+        batch = [await queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                # Забираем то, что уже успело прийти, не дожидаясь новых
+                while len(batch) < self.max_batch and not queue.empty():
+                    batch.append(queue.get_nowait())
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self, queue: asyncio.Queue) -> None:
+        while True:
+            batch = await self._collect(queue)
+            # Батч отправляется отдельной задачей: пока он в полёте, собирается следующий
+            task = asyncio.get_running_loop().create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: list[tuple]) -> None:
+        # Ожидающий отменён (вопрос дополнен, апдейт прерван) — его текст не эмбеддим
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            return
+        dispatched = time.perf_counter()
+        for _, _, enqueued in batch:
+            observe(
+                "embedding_batch_wait_seconds", dispatched - enqueued,
+                "Ожидание вопроса в очереди батчера эмбеддингов", buckets=WAIT_BUCKETS,
+            )
+        observe(
+            "embedding_batch_size", len(batch),
+            "Число вопросов в одном запросе к embeddings API", buckets=BATCH_SIZE_BUCKETS,
+        )
+        # Одинаковые вопросы в батче отправляются один раз
+        unique = list(dict.fromkeys(text for text, _, _ in batch))
+        try:
+            vectors = await asyncio.to_thread(self.embed_many, unique)
+            by_text = dict(zip(unique, vectors))
+            for text, future, _ in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+        except Exception as e:
+            logger.warning("Ошибка батча эмбеддингов (%d шт.): %s", len(batch), e)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
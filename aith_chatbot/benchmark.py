@@ -0,0 +1,676 @@
+"""
+Офлайн-бенчмарк handle_message: синтетические апдейты из replay-файла,
+подменные клиенты OpenAI (задержка/джиттер), Qdrant в памяти и отправка в Telegram.
+Отчёт: пропускная способность, p50/p95/p99 и память по сценариям; результат пишется в JSON
+для сравнения между коммитами.
+"""
+import asyncio
+import hashlib
+import json
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+import numpy as np
+
+from .config import (
+    BASE_DIR,
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    DATA_DIR,
+    DEBOUNCE_WINDOW_MS,
+    EMBEDDING_DIM,
+    EMBEDDING_MODEL,
+    EMBEDDING_MODEL_DIM,
+    QDRANT_COLLECTION,
+)
+
+REPLAY_FILE = BASE_DIR / "bench" / "replay.jsonl"
+
+FAKE_ANSWER = (
+    "Поступить можно через вступительный экзамен, олимпиады или конкурс портфолио. "
+    "Обучение длится два года, форма очная с дистанционными занятиями. "
+) * 4
+
+
+@dataclass
+class FakeLatency:
+    """Задержка подменного сервиса: base_ms ± jitter_ms (равномерно)."""
+
+    base_ms: float = 0.0
+    jitter_ms: float = 0.0
+    rng: random.Random = field(default_factory=lambda: random.Random(0))
+
+    def seconds(self) -> float:
+        jitter = self.rng.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        return max(0.0, self.base_ms + jitter) / 1000
+
+    def sleep(self) -> None:
+        delay = self.seconds()
+        if delay:
+            time.sleep(delay)
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> list[float]:
+    """Детерминированный нормированный псевдо-эмбеддинг по хэшу текста."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    vec /= np.linalg.norm(vec)
+    return vec.tolist()
+
+
+class FakeOpenAI:
+    """
+    Подмена openai.OpenAI: chat.completions.create и embeddings.create.
+    Релевантность определяется правилами из knowledge.is_relevant, ответ — фиксированный текст.
+    """
+
+    def __init__(self, chat_latency: FakeLatency, embedding_latency: FakeLatency):
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        self.calls = {"chat": 0, "embeddings": 0}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat_create))
+        self.embeddings = SimpleNamespace(create=self._embeddings_create)
+
+    def _chat_create(self, model: str, messages: list[dict], max_tokens: int = 0, **kwargs):
+        from .knowledge import is_relevant
+
+        self.calls["chat"] += 1
+        self.chat_latency.sleep()
+        system = messages[0]["content"] if messages else ""
+        user = messages[-1]["content"] if messages else ""
+        if "RELEVANT или IRRELEVANT" in system:
+            content = "RELEVANT" if is_relevant(user) else "IRRELEVANT"
+        else:
+            content = FAKE_ANSWER
+        usage = SimpleNamespace(
+            prompt_tokens=sum(len(m["content"]) for m in messages) // 4,
+            completion_tokens=len(content) // 4,
+        )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage,
+        )
+
+    def _embeddings_create(self, model: str, input, **kwargs):
+        self.calls["embeddings"] += 1
+        self.embedding_latency.sleep()
+        inputs = [input] if isinstance(input, str) else list(input)
+        dim = kwargs.get("dimensions") or EMBEDDING_MODEL_DIM
+        data = [SimpleNamespace(embedding=fake_embedding(t, dim), index=i) for i, t in enumerate(inputs)]
+        usage = SimpleNamespace(prompt_tokens=sum(len(t) for t in inputs) // 4, completion_tokens=0)
+        return SimpleNamespace(data=data, usage=usage)
+
+
+def _fake_summary_llm():
+    """Подмена ChatOpenAI для суммаризации истории (без сети и токенайзера HF)."""
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    class _SummaryLLM(FakeListChatModel):
+        def get_num_tokens(self, text: str) -> int:
+            return len(text) // 4
+
+        def get_num_tokens_from_messages(self, messages, tools=None) -> int:
+            return sum(len(str(m.content)) for m in messages) // 4
+
+    return _SummaryLLM(responses=["Абитуриент спрашивал о поступлении и учебном плане."])
+
+
+class FakeMessage:
+    """Сообщение Telegram: reply_text сохраняет ответ и имитирует задержку Bot API."""
+
+    def __init__(self, text: str, latency: FakeLatency, sent: list):
+        self.text = text
+        self._latency = latency
+        self._sent = sent
+
+    async def reply_text(self, text: str, **kwargs) -> SimpleNamespace:
+        delay = self._latency.seconds()
+        if delay:
+            await asyncio.sleep(delay)
+        self._sent.append(text)
+        return SimpleNamespace(text=text)
+
+
+def make_update(update_id: int, user_id: int, text: str, latency: FakeLatency, sent: list):
+    """Синтетический объект, совместимый с тем, что handle_message читает из telegram.Update."""
+    return SimpleNamespace(
+        update_id=update_id,
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id),
+        message=FakeMessage(text, latency, sent),
+    )
+
+
+class FakeContext:
+    """Минимальный ContextTypes.DEFAULT_TYPE: user_data на пользователя."""
+
+    _user_data: dict[int, dict] = {}
+
+    def __init__(self, user_id: int):
+        self.user_data = self._user_data.setdefault(user_id, {})
+
+
+def install_fakes(
+    chat_latency: FakeLatency,
+    embedding_latency: FakeLatency,
+) -> FakeOpenAI:
+    """
+    Подменяет клиентов в модулях пакета: OpenAI → FakeOpenAI, Qdrant → in-memory,
+    LLM суммаризации истории → фейковая модель. Собирает индекс из data/*.md.
+    OPENAI_API_KEY должен быть задан (любым значением) до импорта пакета — см. run_benchmark.py.
+    """
+    from qdrant_client import QdrantClient
+
+    from . import bot, history, llm, rag
+    from .delivery import DeliveryQueue
+
+    fake = FakeOpenAI(chat_latency, embedding_latency)
+    # Фейковый Telegram не ограничивает частоту: лимиты доставки не должны искажать замер
+    bot.outbox = DeliveryQueue(chat_rate=0, global_rate=0)
+    rag._openai_client = fake
+    llm._client = fake
+    rag._qdrant_client = QdrantClient(location=":memory:")
+    history._get_llm = _fake_summary_llm
+    # Как в bot.main(): ленивые импорты LangChain не должны попадать в замеры первого запроса
+    history.warm_up()
+    # Индекс строится без имитации задержки и не попадает в счётчики вызовов
+    fake.embedding_latency = FakeLatency()
+    rag.build_index(force=True)
+    fake.embedding_latency = embedding_latency
+    fake.calls = {"chat": 0, "embeddings": 0}
+    return fake
+
+
+def load_replay(path: Path = REPLAY_FILE) -> dict[str, list[dict]]:
+    """
+    Читает replay-файл: JSONL, каждая строка {"scenario", "text"} и опционально
+    "user_id" (фиксированный пользователь — накапливается история), "command" ("program", "electives")
+    и "gap_ms" (через сколько мс придёт следующая реплика, не дожидаясь ответа на эту).
+    """
+    scenarios: dict[str, list[dict]] = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            item = json.loads(line)
+            scenarios.setdefault(item["scenario"], []).append(item)
+    return scenarios
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+async def run_scenario(
+    name: str,
+    items: list[dict],
+    iterations: int,
+    concurrency: int,
+    telegram_latency: FakeLatency,
+    fake: FakeOpenAI,
+    measure_memory: bool = True,
+) -> dict:
+    """Прогоняет сценарий iterations раз с заданным числом одновременных пользователей."""
+    from . import bot, history, metrics
+
+    metrics.reset()
+    history._user_memories.clear()
+    bot.USER_STATE.clear()
+    FakeContext._user_data.clear()
+    calls_before = dict(fake.calls)
+    sent: list[str] = []
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+    counter = iter(range(1, 10**9))
+
+    async def one(iteration: int, item: dict) -> None:
+        update_id = next(counter)
+        # Без user_id — новый пользователь на каждый апдейт (без истории)
+        user_id = item.get("user_id", 10**6 + update_id) + iteration * 10**7
+        update = make_update(update_id, user_id, item["text"], telegram_latency, sent)
+        ctx = FakeContext(user_id)
+        async with semaphore:
+            start = time.perf_counter()
+            command = item.get("command")
+            if command == "program":
+                await bot.cmd_program(update, ctx)
+            elif command == "electives":
+                await bot.cmd_electives(update, ctx)
+            else:
+                await bot.handle_message(update, ctx)
+            latencies.append(time.perf_counter() - start)
+
+    async def conversation(iteration: int) -> None:
+        # Реплики одного пользователя идут последовательно, разные итерации — параллельно.
+        # С "gap_ms" следующая реплика приходит через gap_ms, не дожидаясь ответа (вопрос по частям)
+        background = []
+        for item in items:
+            if "gap_ms" in item:
+                background.append(asyncio.create_task(one(iteration, item)))
+                await asyncio.sleep(item["gap_ms"] / 1000)
+            else:
+                await one(iteration, item)
+        await asyncio.gather(*background)
+
+    if measure_memory:
+        tracemalloc.start()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(conversation(i) for i in range(iterations)))
+    # Задержка запроса — время обработчика; пропускная способность — до доставки всех ответов
+    await bot.outbox.join()
+    wall = time.perf_counter() - wall_start
+    peak = 0
+    if measure_memory:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    latencies_ms = [x * 1000 for x in latencies]
+    stages = {
+        stage: round(total / count * 1000, 3)
+        for stage, (count, total) in sorted(metrics.histogram_summary("stage_latency_seconds").items())
+    }
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "replies": len(sent),
+        "throughput_rps": round(len(latencies) / wall, 3) if wall else 0.0,
+        "p50_ms": round(_percentile(latencies_ms, 50), 3),
+        "p95_ms": round(_percentile(latencies_ms, 95), 3),
+        "p99_ms": round(_percentile(latencies_ms, 99), 3),
+        "peak_memory_kb": round(peak / 1024, 1) if measure_memory else None,
+        "openai_calls": {k: fake.calls[k] - calls_before.get(k, 0) for k in fake.calls},
+        "stage_mean_ms": stages,
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR, capture_output=True, text=True, timeout=5,
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def run_benchmark(
+    replay_path: Path = REPLAY_FILE,
+    scenarios: Optional[list[str]] = None,
+    iterations: int = 20,
+    concurrency: int = 8,
+    chat_latency: Optional[FakeLatency] = None,
+    embedding_latency: Optional[FakeLatency] = None,
+    telegram_latency: Optional[FakeLatency] = None,
+    measure_memory: bool = True,
+    debounce_ms: Optional[float] = None,
+) -> dict:
+    """
+    Полный прогон: установка подмен, все сценарии из replay-файла, сводный отчёт.
+    debounce_ms — окно склейки сообщений (по умолчанию DEBOUNCE_WINDOW_MS, как в боте).
+    """
+    from . import bot
+    from .debounce import QuestionDebouncer
+
+    chat_latency = chat_latency or FakeLatency(300, 100)
+    embedding_latency = embedding_latency or FakeLatency(50, 20)
+    telegram_latency = telegram_latency or FakeLatency(30, 10)
+    fake = install_fakes(chat_latency, embedding_latency)
+    if debounce_ms is None:
+        debounce_ms = DEBOUNCE_WINDOW_MS
+    bot.debouncer = QuestionDebouncer(debounce_ms)
+    replay = load_replay(replay_path)
+    results = []
+    for name, items in replay.items():
+        if scenarios and name not in scenarios:
+            continue
+        results.append(
+            await run_scenario(
+                name, items, iterations, concurrency, telegram_latency, fake, measure_memory
+            )
+        )
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "params": {
+            "iterations": iterations,
+            "concurrency": concurrency,
+            "chat_latency_ms": [chat_latency.base_ms, chat_latency.jitter_ms],
+            "embedding_latency_ms": [embedding_latency.base_ms, embedding_latency.jitter_ms],
+            "telegram_latency_ms": [telegram_latency.base_ms, telegram_latency.jitter_ms],
+            "debounce_ms": debounce_ms,
+        },
+        "results": results,
+    }
+
+
+def _measure(fn, setup=None) -> tuple[int, float, int]:
+    """
+    (результат fn, секунды, пик памяти tracemalloc в байтах).
+    Время и память замеряются отдельными прогонами: tracemalloc искажает время.
+    setup вызывается перед каждым прогоном.
+    """
+    if setup:
+        setup()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_chunking_benchmark(scale: int = 100, data_dir: Path = DATA_DIR) -> dict:
+    """
+    Чанкинг корпуса из data/*.md, размноженного scale раз (копии различаются, чтобы не совпадали
+    ключи кэша): прежний RecursiveCharacterTextSplitter со списком всех чанков против потокового
+    chunking.iter_chunks с холодным и тёплым кэшем.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    from .chunking import iter_chunks
+
+    sources = sorted(data_dir.glob("*.md"))
+    tmp = Path(tempfile.mkdtemp(prefix="aith_chunk_bench_"))
+    corpus, cache = tmp / "corpus", tmp / "cache"
+    corpus.mkdir()
+    total_bytes = 0
+    for i in range(scale):
+        for src in sources:
+            text = src.read_text(encoding="utf-8") + f"\n\nКопия {i}\n"
+            total_bytes += len(text.encode("utf-8"))
+            (corpus / f"{src.stem}_{i:04d}.md").write_text(text, encoding="utf-8")
+
+    def legacy() -> int:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=len,
+            separators=["\n\n", "\n", ". ", " ", ""],
+        )
+        chunks = []
+        for path in sorted(corpus.glob("*.md")):
+            for piece in splitter.split_text(path.read_text(encoding="utf-8").strip()):
+                if piece.strip():
+                    chunks.append({"text": piece.strip(), "source": path.stem})
+        return len(chunks)
+
+    def streamed() -> int:
+        return sum(1 for _ in iter_chunks(corpus, cache))
+
+    def drop_cache() -> None:
+        shutil.rmtree(cache, ignore_errors=True)
+
+    results = []
+    try:
+        variants = (
+            ("recursive_splitter", legacy, None),
+            ("sections_cold", streamed, drop_cache),
+            ("sections_warm", streamed, None),
+        )
+        for name, fn, setup in variants:
+            count, elapsed, peak = _measure(fn, setup)
+            results.append({
+                "variant": name,
+                "chunks": count,
+                "seconds": round(elapsed, 3),
+                "mb_per_s": round(total_bytes / 2**20 / elapsed, 2) if elapsed else None,
+                "peak_memory_kb": round(peak / 1024, 1),
+            })
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "params": {"scale": scale, "files": scale * len(sources), "corpus_mb": round(total_bytes / 2**20, 2)},
+        "results": results,
+    }
+
+
+def format_chunking_report(report: dict) -> str:
+    """Таблица результатов бенчмарка чанкинга."""
+    lines = [
+        f"commit={report['commit']} python={report['python']} {report['params']}",
+        f"{'variant':<22}{'chunks':>9}{'sec':>9}{'MB/s':>9}{'peak KB':>12}",
+    ]
+    for r in report["results"]:
+        lines.append(
+            f"{r['variant']:<22}{r['chunks']:>9}{r['seconds']:>9}{r['mb_per_s']:>9}{r['peak_memory_kb']:>12}"
+        )
+    return "\n".join(lines)
+
+
+def _embed_texts(texts: list[str], fake: bool, batch_size: int = 64) -> np.ndarray:
+    """Эмбеддинги полной размерности (реальный OpenAI или детерминированные фейковые)."""
+    if fake:
+        return np.array([fake_embedding(t, EMBEDDING_MODEL_DIM) for t in texts], dtype=np.float32)
+    from .rag import _get_openai_client
+
+    client = _get_openai_client()
+    vectors = []
+    for i in range(0, len(texts), batch_size):
+        r = client.embeddings.create(model=EMBEDDING_MODEL, input=[t[:8000] for t in texts[i:i + batch_size]])
+        vectors.extend(d.embedding for d in sorted(r.data, key=lambda d: d.index))
+    return np.array(vectors, dtype=np.float32)
+
+
+def _truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    """Уменьшение размерности как у параметра dimensions text-embedding-3: обрезка и нормировка."""
+    cut = vectors[:, :dim]
+    return cut / np.linalg.norm(cut, axis=1, keepdims=True)
+
+
+def _bytes_in_ram(mode: str, dim: int, n: int) -> int:
+    """Оценка объёма векторов в RAM: float32 — 4 байта на компоненту, int8 — 1, binary — 1 бит."""
+    per_vector = {"": dim * 4, "int8": dim, "binary": (dim + 7) // 8}[mode]
+    return per_vector * n
+
+
+def default_queries(replay_path: Path = REPLAY_FILE) -> list[str]:
+    """Вопросы из релевантных сценариев replay-файла."""
+    return [
+        item["text"]
+        for name, items in load_replay(replay_path).items()
+        if name.startswith("relevant")
+        for item in items
+        if "command" not in item
+    ]
+
+
+def run_quantization_benchmark(
+    queries: list[str],
+    modes: tuple[str, ...] = ("", "int8", "binary"),
+    dims: tuple[int, ...] = (EMBEDDING_MODEL_DIM,),
+    top_k: int = 5,
+    repeats: int = 20,
+    fake_embeddings: bool = False,
+) -> dict:
+    """
+    Recall@k, задержка поиска и объём векторов в RAM для float32 и квантованных коллекций
+    (с oversampling и rescoring) против точного поиска по float32 полной размерности.
+    Нужен запущенный Qdrant (QDRANT_HOST/QDRANT_PORT): в локальном режиме квантования нет.
+    Временные коллекции удаляются после замера.
+    """
+    from qdrant_client.models import Distance, OptimizersConfigDiff, PointStruct, VectorParams
+
+    from .chunking import iter_chunks
+    from .rag import _embedding_input, get_qdrant_client, quantization_config, search_params
+
+    chunks = list(iter_chunks())
+    # Как в build_index: эмбеддинг пути заголовков вместе с текстом чанка
+    docs = _embed_texts([_embedding_input(c) for c in chunks], fake_embeddings)
+    qs = _embed_texts(queries, fake_embeddings)
+    client = get_qdrant_client()
+    results = []
+    for dim in dims:
+        doc_vecs, q_vecs = _truncate(docs, dim), _truncate(qs, dim)
+        # Эталон: точный косинусный поиск по полным float32 векторам
+        truth = np.argsort(-(_truncate(qs, EMBEDDING_MODEL_DIM) @ _truncate(docs, EMBEDDING_MODEL_DIM).T), axis=1)[:, :top_k]
+        for mode in modes:
+            name = f"{QDRANT_COLLECTION}_bench_{mode or 'float32'}_{dim}"
+            quant = quantization_config(mode)
+            if client.collection_exists(name):
+                client.delete_collection(name)
+            client.create_collection(
+                collection_name=name,
+                vectors_config=VectorParams(size=dim, distance=Distance.COSINE, on_disk=quant is not None),
+                quantization_config=quant,
+                # Индексируем сразу, чтобы квантованные сегменты построились и на маленьком корпусе
+                optimizers_config=OptimizersConfigDiff(indexing_threshold=1),
+            )
+            try:
+                client.upsert(
+                    collection_name=name,
+                    points=[PointStruct(id=i, vector=v.tolist(), payload={}) for i, v in enumerate(doc_vecs)],
+                    wait=True,
+                )
+                for _ in range(100):
+                    if str(client.get_collection(name).status).lower().endswith("green"):
+                        break
+                    time.sleep(0.1)
+                latencies, hits = [], 0
+                params = search_params(mode)
+                for repeat in range(repeats):
+                    for qi, q in enumerate(q_vecs):
+                        start = time.perf_counter()
+                        r = client.query_points(
+                            collection_name=name, query=q.tolist(), limit=top_k, search_params=params
+                        )
+                        latencies.append((time.perf_counter() - start) * 1000)
+                        if repeat == 0:
+                            hits += len({p.id for p in r.points} & set(truth[qi].tolist()))
+                results.append({
+                    "mode": mode or "float32",
+                    "dim": dim,
+                    f"recall@{top_k}": round(hits / (len(q_vecs) * top_k), 4),
+                    "p50_ms": round(_percentile(latencies, 50), 3),
+                    "p95_ms": round(_percentile(latencies, 95), 3),
+                    "vectors_ram_kb": round(_bytes_in_ram(mode, dim, len(doc_vecs)) / 1024, 1),
+                })
+            finally:
+                client.delete_collection(name)
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "params": {
+            "points": len(chunks),
+            "queries": len(queries),
+            "top_k": top_k,
+            "repeats": repeats,
+            "fake_embeddings": fake_embeddings,
+        },
+        "results": results,
+    }
+
+
+def format_quantization_report(report: dict) -> str:
+    """Таблица результатов бенчмарка квантования."""
+    k = report["params"]["top_k"]
+    lines = [
+        f"commit={report['commit']} python={report['python']} {report['params']}",
+        f"{'mode':<10}{'dim':>6}{'recall@' + str(k):>11}{'p50 ms':>10}{'p95 ms':>10}{'RAM KB':>10}",
+    ]
+    for r in report["results"]:
+        lines.append(
+            f"{r['mode']:<10}{r['dim']:>6}{r[f'recall@{k}']:>11}{r['p50_ms']:>10}{r['p95_ms']:>10}{r['vectors_ram_kb']:>10}"
+        )
+    return "\n".join(lines)
+
+
+def run_transport_benchmark(
+    points: int = 5000,
+    dim: int = EMBEDDING_DIM,
+    queries: int = 200,
+    top_k: int = 5,
+    batch_size: int = 256,
+) -> dict:
+    """
+    REST против gRPC на запущенном Qdrant (QDRANT_HOST, QDRANT_PORT / QDRANT_GRPC_PORT):
+    пропускная способность bulk-загрузки (точек/с) и задержка поиска p50/p95.
+    Векторы случайные — эмбеддинги не нужны. Временная коллекция удаляется после замера.
+    """
+    from qdrant_client import QdrantClient
+    from qdrant_client.models import Distance, VectorParams
+
+    from .rag import qdrant_client_kwargs
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((points, dim), dtype=np.float32)
+    q_vecs = rng.standard_normal((queries, dim), dtype=np.float32)
+    payload = [{"text": f"chunk {i}", "source": "bench"} for i in range(points)]
+    results = []
+    for transport, prefer_grpc in (("rest", False), ("grpc", True)):
+        client = QdrantClient(**qdrant_client_kwargs(prefer_grpc=prefer_grpc))
+        name = f"{QDRANT_COLLECTION}_bench_{transport}"
+        if client.collection_exists(name):
+            client.delete_collection(name)
+        client.create_collection(name, vectors_config=VectorParams(size=dim, distance=Distance.COSINE))
+        try:
+            start = time.perf_counter()
+            client.upload_collection(
+                collection_name=name, vectors=vectors, payload=payload,
+                ids=range(points), batch_size=batch_size, wait=True,
+            )
+            upload_s = time.perf_counter() - start
+            # Первый поиск прогревает соединение и не попадает в замер
+            client.query_points(collection_name=name, query=q_vecs[0].tolist(), limit=top_k)
+            latencies = []
+            for q in q_vecs:
+                start = time.perf_counter()
+                client.query_points(collection_name=name, query=q.tolist(), limit=top_k, with_payload=True)
+                latencies.append((time.perf_counter() - start) * 1000)
+            results.append({
+                "transport": transport,
+                "upsert_points_per_s": round(points / upload_s, 1),
+                "search_p50_ms": round(_percentile(latencies, 50), 3),
+                "search_p95_ms": round(_percentile(latencies, 95), 3),
+            })
+        finally:
+            client.delete_collection(name)
+            client.close()
+    return {
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "params": {"points": points, "dim": dim, "queries": queries, "top_k": top_k, "batch_size": batch_size},
+        "results": results,
+    }
+
+
+def format_transport_report(report: dict) -> str:
+    """Таблица результатов бенчмарка REST vs gRPC."""
+    lines = [
+        f"commit={report['commit']} python={report['python']} {report['params']}",
+        f"{'transport':<10}{'upsert pts/s':>14}{'p50 ms':>10}{'p95 ms':>10}",
+    ]
+    for r in report["results"]:
+        lines.append(
+            f"{r['transport']:<10}{r['upsert_points_per_s']:>14}{r['search_p50_ms']:>10}{r['search_p95_ms']:>10}"
+        )
+    return "\n".join(lines)
+
+
+def format_report(report: dict) -> str:
+    """Таблица результатов для вывода в консоль."""
+    header = f"{'scenario':<24}{'req':>6}{'rps':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'mem KB':>10}"
+    lines = [f"commit={report['commit']} python={report['python']} {report['params']}", header]
+    for r in report["results"]:
+        mem = r["peak_memory_kb"] if r["peak_memory_kb"] is not None else "-"
+        lines.append(
+            f"{r['scenario']:<24}{r['requests']:>6}{r['throughput_rps']:>9}"
+            f"{r['p50_ms']:>10}{r['p95_ms']:>10}{r['p99_ms']:>10}{mem:>10}"
+        )
+    return "\n".join(lines)
@@ -2,7 +2,10 @@
 Telegram-бот для абитуриентов магистратур ИТМО: «Искусственный интеллект» и «AI-продукты и технологии».
 Отвечает только на релевантные вопросы по этим программам; помогает выбрать программу и дисциплины.
 """
+import asyncio
 import logging
+import time
+import weakref
 
 from telegram import Update
 from telegram.helpers import escape_markdown
@@ -14,20 +17,41 @@ from telegram.ext import (
     filters,
 )
 
-from .config import TELEGRAM_BOT_TOKEN, OPENAI_API_KEY
-from .knowledge import is_relevant, answer_from_knowledge
+from .config import (
+    TELEGRAM_BOT_TOKEN,
+    OPENAI_API_KEY,
+    METRICS_PORT,
+    ADMIN_USER_IDS,
+    DELIVERY_CHAT_RATE,
+    DELIVERY_CHAT_BURST,
+    DELIVERY_GLOBAL_RATE,
+    DELIVERY_MAX_RETRIES,
+    DEBOUNCE_WINDOW_MS,
+)
+from .debounce import QuestionDebouncer, Superseded
+from .delivery import DeliveryQueue
+from .knowledge import (
+    is_relevant,
+    answer_from_knowledge,
+    detect_program,
+    load_knowledge,
+    load_programs,
+)
 from .recommendations import recommend_program, recommend_electives
+from .metrics import request_trace, span, start_metrics_server
+from .profiling import profile_request, sample_rate, set_sample_rate, to_thread
 
 if OPENAI_API_KEY:
     from .llm import is_relevant_llm, generate_answer_rag
-    from .rag import has_index, build_index, retrieve
+    from .rag import has_index, aretrieve
+    from .index_bundle import restore_or_build_index
     from .history import get_history_for_prompt, save_turn
 else:
     is_relevant_llm = None
     generate_answer_rag = None
     has_index = None
-    build_index = None
-    retrieve = None
+    restore_or_build_index = None
+    aretrieve = None
     get_history_for_prompt = None
     save_turn = None
 
@@ -51,6 +75,50 @@ def set_state(user_id: int, state: str) -> None:
         USER_STATE.pop(user_id, None)
 
 
+# Очередь исходящих сообщений: лимиты Telegram, flood control, разбиение длинных ответов
+outbox = DeliveryQueue(
+    chat_rate=DELIVERY_CHAT_RATE,
+    chat_burst=DELIVERY_CHAT_BURST,
+    global_rate=DELIVERY_GLOBAL_RATE,
+    max_retries=DELIVERY_MAX_RETRIES,
+)
+
+
+IRRELEVANT_REPLY = (
+    "Я отвечаю только на вопросы, связанные с магистратурами ИТМО «Искусственный интеллект» и «AI-продукты и технологии»: "
+    "поступление, учебные планы, карьера, выбор программы и дисциплин. Задайте, пожалуйста, такой вопрос "
+    "или используйте /program и /electives для подбора."
+)
+
+# Индекс строится не более чем одним обработчиком одновременно
+_index_lock = asyncio.Lock()
+
+# Склейка быстрых сообщений одного пользователя в один вопрос
+debouncer = QuestionDebouncer(DEBOUNCE_WINDOW_MS)
+
+# Апдейты обрабатываются параллельно, но ответы одному пользователю готовятся по очереди.
+# USER_STATE и состояние debouncer меняются только в потоке event loop без await посередине.
+_user_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+
+
+def _user_lock(user_id: int) -> asyncio.Lock:
+    """Блокировка ответов пользователя; удаляется сама, когда её никто не держит."""
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = _user_locks[user_id] = asyncio.Lock()
+    return lock
+
+
+def send_reply(update: Update, text: str, **kwargs) -> None:
+    """Ставит ответ в очередь доставки в чат апдейта; обработчик не ждёт отправки."""
+    outbox.submit(update.effective_chat.id, update.message.reply_text, text, **kwargs)
+
+
+async def drain_outbox(app: Application) -> None:
+    """При остановке бота дожидается доставки уже поставленных в очередь ответов."""
+    await outbox.join(timeout=30)
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     set_state(update.effective_user.id, "")
     text = (
@@ -64,12 +132,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "/electives — подобрать выборные дисциплины (сначала выберите программу)\n"
         "Или просто напишите вопрос — например: «Чем отличаются программы?», «Как поступить?»"
     )
-    await update.message.reply_text(text, parse_mode="Markdown")
+    send_reply(update, text, parse_mode="Markdown")
 
 
 async def cmd_program(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     set_state(update.effective_user.id, "await_program_background")
-    await update.message.reply_text(
+    send_reply(
+        update,
         "Опишите коротко ваш бэкграунд: образование, опыт, чем занимаетесь и что хотите развивать "
         "(например: «Программист, хочу углубиться в ML» или «Менеджер продукта, хочу работать с AI»). "
         "По этому я подберу программу."
@@ -78,7 +147,8 @@ async def cmd_program(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
 
 async def cmd_electives(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     set_state(update.effective_user.id, "await_program_id")
-    await update.message.reply_text(
+    send_reply(
+        update,
         "Для подбора выборных дисциплин укажите программу:\n"
         "• Напишите **ai** — для программы «Искусственный интеллект»\n"
         "• Напишите **ai_product** — для программы «AI-продукты и технологии»"
@@ -91,7 +161,8 @@ async def handle_program_id(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if t in ("ai", "искусственный интеллект", "ии"):
         context.user_data["electives_program_id"] = "ai"
         set_state(tid, "await_electives_background")
-        await update.message.reply_text(
+        send_reply(
+            update,
             "Выбрана программа «Искусственный интеллект». "
             "Опишите коротко ваш бэкграунд и что хотите углубить (например: «Backend, хочу MLOps и данные»)."
         )
@@ -99,7 +170,8 @@ async def handle_program_id(update: Update, context: ContextTypes.DEFAULT_TYPE,
     if t in ("ai_product", "ai продукт", "продукты"):
         context.user_data["electives_program_id"] = "ai_product"
         set_state(tid, "await_electives_background")
-        await update.message.reply_text(
+        send_reply(
+            update,
             "Выбрана программа «AI-продукты и технологии». "
             "Опишите коротко ваш бэкграунд и интересы (например: «Менеджер, хочу стратегию и метрики»)."
         )
@@ -107,7 +179,35 @@ async def handle_program_id(update: Update, context: ContextTypes.DEFAULT_TYPE,
     return False
 
 
+async def cmd_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Только для ADMIN_USER_IDS: /profile — текущая доля, /profile 0.05 — профилировать 5% апдейтов,
+    /profile off — выключить, /profile next — профилировать следующее сообщение администратора.
+    """
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        return
+    arg = (context.args[0] if context.args else "").lower()
+    if arg == "next":
+        context.user_data["profile_next"] = True
+        send_reply(update, "Следующее сообщение будет профилировано.")
+        return
+    if arg:
+        try:
+            rate = 0.0 if arg == "off" else float(arg)
+        except ValueError:
+            send_reply(update, "Использование: /profile [доля 0..1 | off | next]")
+            return
+        set_sample_rate(rate)
+    send_reply(update, f"Профилирование: доля апдейтов {sample_rate():g}")
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    force_profile = context.user_data.pop("profile_next", False)
+    with request_trace(update.update_id), profile_request(update.update_id, force=force_profile):
+        await _handle_message(update, context)
+
+
+async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
     text = (update.message.text or "").strip()
     if not text:
@@ -119,66 +219,161 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         if await handle_program_id(update, context, text):
             pass
         else:
-            await update.message.reply_text("Напишите **ai** или **ai_product**.", parse_mode="Markdown")
+            send_reply(update, "Напишите **ai** или **ai_product**.", parse_mode="Markdown")
         return
 
     if state == "await_program_background":
         set_state(user_id, "")
         reply = recommend_program(text)
-        await update.message.reply_text(escape_markdown(reply, version=1), parse_mode="Markdown")
+        send_reply(update, escape_markdown(reply, version=1), parse_mode="Markdown")
         return
 
     if state == "await_electives_background":
         set_state(user_id, "")
         program_id = context.user_data.get("electives_program_id", "ai")
         reply = recommend_electives(program_id, text)
-        await update.message.reply_text(escape_markdown(reply, version=1), parse_mode="Markdown")
+        send_reply(update, escape_markdown(reply, version=1), parse_mode="Markdown")
+        return
+
+    # Несколько быстрых сообщений подряд — один вопрос; обработчик раннего фрагмента завершается
+    question = await debouncer.collect(user_id, text)
+    if question is None:
         return
+    generation = debouncer.generation(user_id)
+    await debouncer.run(user_id, _answer_question(update, context, question, generation))
+
+
+async def ensure_index(update: Update) -> bool:
+    """
+    Загружает индекс из бандла или собирает его, если коллекция пуста (прогрев не удался).
+    Одновременно строит индекс только один обработчик: остальные ждут и проверяют результат.
+    Возвращает True, если индекс готов.
+    """
+    async with _index_lock:
+        if await to_thread(has_index):
+            return True
+        send_reply(update, "Строю индекс в Qdrant, подождите несколько секунд…")
+        try:
+            with span("build_index"):
+                await to_thread(restore_or_build_index)
+        except Exception as e:
+            logger.warning("Не удалось построить индекс: %s", e)
+        return await to_thread(has_index)
+
 
+async def _paid_call(user_id: int, generation: int, func, *args):
+    """
+    Платный вызов OpenAI в потоке — только если вопрос не дополнен новым фрагментом.
+    Проверка делается в самом потоке, непосредственно перед запросом: отмена задачи
+    не останавливает уже запущенный поток. Используется до debouncer.commit.
+    """
+    def guarded():
+        if not debouncer.is_current(user_id, generation):
+            raise Superseded()
+        return func(*args)
+
+    return await to_thread(guarded)
+
+
+async def _answer_question(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    generation: int,
+) -> None:
+    """
+    Ответ на свободный вопрос (RAG или база знаний). До debouncer.commit задача может быть
+    отменена новым фрагментом вопроса — поэтому commit стоит непосредственно перед отправкой.
+    Следующий вопрос того же пользователя ждёт, пока этот ответ не сохранится в историю.
+    """
+    async with _user_lock(update.effective_user.id):
+        await _answer(update, context, text, generation)
+
+
+async def _answer(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, generation: int) -> None:
+    user_id = update.effective_user.id
     use_rag = bool(OPENAI_API_KEY and is_relevant_llm and generate_answer_rag)
     if use_rag:
-        if not is_relevant_llm(text):
-            await update.message.reply_text(
-                "Я отвечаю только на вопросы, связанные с магистратурами ИТМО «Искусственный интеллект» и «AI-продукты и технологии»: "
-                "поступление, учебные планы, карьера, выбор программы и дисциплин. Задайте, пожалуйста, такой вопрос "
-                "или используйте /program и /electives для подбора."
-            )
+        # Синхронные вызовы OpenAI/Qdrant/LangChain — в потоках: event loop тем временем
+        # обслуживает других пользователей, а их вопросы попадают в общий батч эмбеддингов
+        if not await _paid_call(user_id, generation, is_relevant_llm, text):
+            debouncer.commit(user_id)
+            send_reply(update, IRRELEVANT_REPLY)
             return
-        if not has_index():
-            await update.message.reply_text("Строю индекс в Qdrant, подождите несколько секунд…")
-            build_index()
-            if not has_index():
-                await update.message.reply_text(
-                    "Не удалось построить индекс. Убедитесь, что в папке data/ есть .md файлы "
-                    "(запустите: python run_scraper.py) и что Qdrant запущен."
-                )
-                return
-        rag_context = retrieve(text)
-        history_str = get_history_for_prompt(user_id) if get_history_for_prompt else ""
-        reply = generate_answer_rag(text, rag_context, history_str)
-        if save_turn:
-            save_turn(user_id, text, reply)
-    else:
-        if not is_relevant(text):
-            await update.message.reply_text(
-                "Я отвечаю только на вопросы, связанные с магистратурами ИТМО «Искусственный интеллект» и «AI-продукты и технологии»: "
-                "поступление, учебные планы, карьера, выбор программы и дисциплин. Задайте, пожалуйста, такой вопрос "
-                "или используйте /program и /electives для подбора."
+        if not await to_thread(has_index) and not await ensure_index(update):
+            debouncer.commit(user_id)
+            send_reply(
+                update,
+                "Не удалось построить индекс. Убедитесь, что в папке data/ есть .md файлы "
+                "(запустите: python run_scraper.py) и что Qdrant запущен."
             )
             return
-        reply = answer_from_knowledge(text)
+        # Программа из вопроса; None — поиск по обеим
+        program_id = detect_program(text)
+        rag_context, history_str = await asyncio.gather(
+            aretrieve(text, program_id=program_id),
+            to_thread(get_history_for_prompt, user_id) if get_history_for_prompt else asyncio.sleep(0, ""),
+        )
+        reply = await _paid_call(user_id, generation, generate_answer_rag, text, rag_context, history_str)
+        debouncer.commit(user_id)
+        send_reply(update, escape_markdown(reply, version=1), parse_mode="Markdown")
+        # В историю — один ход на склеенный вопрос, после отправки ответа
+        if save_turn:
+            await to_thread(save_turn, user_id, text, reply)
+        return
+    debouncer.commit(user_id)
+    if not is_relevant(text):
+        send_reply(update, IRRELEVANT_REPLY)
+        return
     # Экранируем Markdown в динамических ответах (LLM/база знаний), чтобы не ломать парсер Telegram
-    await update.message.reply_text(escape_markdown(reply, version=1), parse_mode="Markdown")
+    send_reply(update, escape_markdown(answer_from_knowledge(text), version=1), parse_mode="Markdown")
+
+
+def warm_up() -> None:
+    """
+    Прогрев до приёма апдейтов: данные программ в память, LangChain и клиенты OpenAI/Qdrant
+    с открытыми соединениями, индекс из бандла в Qdrant — первый пользователь не платит за холодный старт.
+    """
+    start = time.perf_counter()
+    load_programs()
+    load_knowledge()
+    if OPENAI_API_KEY:
+        from . import history, index_bundle, llm, rag
+
+        for name, fn in (
+            ("llm", llm.warm_up),
+            ("rag", rag.warm_up),
+            ("index", index_bundle.warm_up),
+            ("history", history.warm_up),
+        ):
+            try:
+                with span(f"warm_up_{name}"):
+                    fn()
+            except Exception as e:
+                logger.warning("Прогрев %s не удался: %s", name, e)
+    logger.info("Прогрев завершён за %.2f с", time.perf_counter() - start)
 
 
 def main() -> None:
     if not TELEGRAM_BOT_TOKEN:
         logger.error("Укажите TELEGRAM_BOT_TOKEN в переменных окружения или в .env")
         return
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+    warm_up()
+    # Апдейты обрабатываются параллельно (иначе батчинг эмбеддингов бесполезен);
+    # ответы одному пользователю упорядочены блокировкой в _answer_question
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(True)
+        .post_stop(drain_outbox)
+        .build()
+    )
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("program", cmd_program))
     app.add_handler(CommandHandler("electives", cmd_electives))
+    app.add_handler(CommandHandler("profile", cmd_profile))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     logger.info("Бот запущен")
     app.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,257 @@
+"""
+Разбиение Markdown на чанки с учётом структуры: секции по заголовкам, таблицы и блоки кода
+не разрываются, путь заголовков сохраняется в чанке. Результат кэшируется по файлу
+с ключом (хэш содержимого, настройки чанкинга) — неизменённые файлы повторно не режутся.
+"""
+import hashlib
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Iterator
+
+from .config import CHUNK_CACHE_DIR, CHUNK_OVERLAP, CHUNK_SIZE, DATA_DIR
+from .metrics import count_cache
+
+logger = logging.getLogger(__name__)
+
+# Меняется при изменении алгоритма — старый кэш становится недействительным
+CHUNKER_VERSION = 1
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+")
+
+# Глубина пути заголовков, граница которой не пересекается чанком: 2 — «# Страница» / «## Раздел»
+SECTION_DEPTH = 2
+
+
+def _is_table(line: str) -> bool:
+    return line.lstrip().startswith("|")
+
+
+def _is_fence(line: str) -> bool:
+    stripped = line.lstrip()
+    return stripped.startswith("```") or stripped.startswith("~~~")
+
+
+def _blocks(lines: list[str]) -> Iterator[tuple[str, str]]:
+    """
+    Делит тело секции на блоки: ("table", ...), ("code", ...) или ("text", абзац).
+    Таблицы и блоки кода возвращаются целиком.
+    """
+    i = 0
+    n = len(lines)
+    while i < n:
+        line = lines[i]
+        if not line.strip():
+            i += 1
+            continue
+        if _is_fence(line):
+            fence = line.lstrip()[:3]
+            j = i + 1
+            while j < n and not lines[j].lstrip().startswith(fence):
+                j += 1
+            yield "code", "\n".join(lines[i:j + 1])
+            i = j + 1
+            continue
+        if _is_table(line):
+            j = i
+            while j < n and _is_table(lines[j]):
+                j += 1
+            yield "table", "\n".join(lines[i:j])
+            i = j
+            continue
+        j = i
+        while j < n and lines[j].strip() and not _is_table(lines[j]) and not _is_fence(lines[j]):
+            j += 1
+        yield "text", "\n".join(line.rstrip() for line in lines[i:j])
+        i = j
+
+
+def iter_sections(content: str) -> Iterator[tuple[list[str], str, list[str]]]:
+    """
+    Секции Markdown: (путь заголовков от верхнего уровня, строка заголовка секции, строки тела).
+    Для текста до первого заголовка путь пустой, а строка заголовка — "".
+    """
+    path: list[tuple[int, str]] = []
+    heading_line = ""
+    body: list[str] = []
+    in_fence = False
+    for line in content.splitlines():
+        if _is_fence(line):
+            in_fence = not in_fence
+        # Быстрая проверка первого символа: регулярка только для строк-кандидатов в заголовки
+        m = _HEADING_RE.match(line) if not in_fence and line.startswith("#") else None
+        if m:
+            if heading_line or any(x.strip() for x in body):
+                yield [title for _, title in path], heading_line, body
+            level, title = len(m.group(1)), m.group(2).strip()
+            path = [(lv, t) for lv, t in path if lv < level] + [(level, title)]
+            heading_line = line.strip()
+            body = []
+        else:
+            body.append(line)
+    if heading_line or any(x.strip() for x in body):
+        yield [title for _, title in path], heading_line, body
+
+
+def _split_oversized(kind: str, text: str, chunk_size: int) -> list[str]:
+    """Режет блок длиннее chunk_size: таблицы по строкам (с повтором шапки), текст по предложениям."""
+    if kind == "table":
+        rows = text.split("\n")
+        header = rows[:2] if len(rows) > 2 and set(rows[1].replace("|", "").strip()) <= set("-: ") else rows[:1]
+        pieces, current = [], list(header)
+        for row in rows[len(header):]:
+            if len("\n".join(current + [row])) > chunk_size and len(current) > len(header):
+                pieces.append("\n".join(current))
+                current = list(header)
+            current.append(row)
+        pieces.append("\n".join(current))
+        return pieces
+    units = _SENTENCE_RE.split(text) if kind == "text" else text.split("\n")
+    pieces, current = [], ""
+    for unit in units:
+        while len(unit) > chunk_size:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(unit[:chunk_size])
+            unit = unit[chunk_size:]
+        candidate = f"{current} {unit}" if current and kind == "text" else (f"{current}\n{unit}" if current else unit)
+        if len(candidate) > chunk_size and current:
+            pieces.append(current)
+            current = unit
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _common_prefix(paths: list[list[str]]) -> list[str]:
+    prefix = list(paths[0])
+    for path in paths[1:]:
+        while path[:len(prefix)] != prefix:
+            prefix.pop()
+    return prefix
+
+
+def chunk_markdown(
+    content: str,
+    source: str,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    section_depth: int = SECTION_DEPTH,
+) -> Iterator[dict]:
+    """
+    Генератор чанков одного Markdown-документа.
+    Чанк не пересекает границу секции уровня section_depth (по умолчанию — секции «## ...» под
+    заголовком страницы); мелкие подсекции внутри неё собираются в один чанк вместе со строками
+    своих заголовков. Соседние чанки перекрываются целыми блоками суммарной длиной до chunk_overlap.
+    Каждый чанк: {"text": str, "source": str, "headings": list[str]} — headings — общий путь
+    заголовков всех секций чанка.
+    """
+    current: list[str] = []
+    paths: list[list[str]] = []
+    size = 0
+    group = None
+
+    def flush() -> dict:
+        return {"text": "\n\n".join(current), "source": source, "headings": _common_prefix(paths)}
+
+    for headings, heading_line, lines in iter_sections(content):
+        key = tuple(headings[:section_depth])
+        if current and key != group:
+            yield flush()
+            current, paths, size = [], [], 0
+        group = key
+        # Заголовки глубже границы группы остаются в тексте чанка
+        blocks = [heading_line] if heading_line and len(headings) > section_depth else []
+        for kind, text in _blocks(lines):
+            if len(text) > chunk_size:
+                blocks.extend(_split_oversized(kind, text, chunk_size))
+            else:
+                blocks.append(text)
+        for block in blocks:
+            if current and size + len(block) + 2 > chunk_size:
+                yield flush()
+                # Перекрытие: последние блоки предыдущего чанка, пока укладываемся в chunk_overlap
+                overlap: list[str] = []
+                overlap_size = 0
+                for prev in reversed(current):
+                    if overlap_size + len(prev) > chunk_overlap or overlap_size + len(prev) + len(block) > chunk_size:
+                        break
+                    overlap.insert(0, prev)
+                    overlap_size += len(prev) + 2
+                current, size = overlap, overlap_size
+                paths = paths[-1:]
+            current.append(block)
+            size += len(block) + 2
+            if not paths or paths[-1] != headings:
+                paths.append(headings)
+    if current:
+        yield flush()
+
+
+def _cache_key(content: str, chunk_size: int, chunk_overlap: int, section_depth: int) -> str:
+    h = hashlib.sha256(content.encode("utf-8"))
+    h.update(f"|{chunk_size}|{chunk_overlap}|{section_depth}|v{CHUNKER_VERSION}".encode())
+    return h.hexdigest()
+
+
+def chunk_file(
+    path: Path,
+    cache_dir: Path | None = CHUNK_CACHE_DIR,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+    section_depth: int = SECTION_DEPTH,
+) -> Iterator[dict]:
+    """
+    Чанки одного .md файла (source = имя файла без расширения).
+    При совпадении ключа кэша чанки читаются из cache_dir без повторного разбиения
+    (попадания и промахи — в cache_hits_total / cache_misses_total{cache="chunks"}).
+    """
+    content = path.read_text(encoding="utf-8").strip()
+    if not content:
+        return
+    source = path.stem
+    key = _cache_key(content, chunk_size, chunk_overlap, section_depth)
+    cache_path = cache_dir / f"{source}.json" if cache_dir else None
+    if cache_path and cache_path.exists():
+        try:
+            cached = json.loads(cache_path.read_text(encoding="utf-8"))
+            if cached.get("key") == key:
+                count_cache("chunks", True)
+                yield from cached["chunks"]
+                return
+        except (OSError, ValueError) as e:
+            logger.warning("Кэш чанков %s повреждён: %s", cache_path, e)
+    if cache_path:
+        count_cache("chunks", False)
+    chunks = []
+    for chunk in chunk_markdown(content, source, chunk_size, chunk_overlap, section_depth):
+        if cache_path:
+            chunks.append(chunk)
+        yield chunk
+    if cache_path:
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            cache_path.write_text(json.dumps({"key": key, "chunks": chunks}, ensure_ascii=False), encoding="utf-8")
+        except OSError as e:
+            logger.warning("Не удалось сохранить кэш чанков %s: %s", cache_path, e)
+
+
+def iter_chunks(
+    data_dir: Path = DATA_DIR,
+    cache_dir: Path | None = CHUNK_CACHE_DIR,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> Iterator[dict]:
+    """Потоковые чанки всех data/*.md: файлы обрабатываются по одному."""
+    if not data_dir.exists():
+        return
+    for path in sorted(data_dir.glob("*.md")):
+        try:
+            yield from chunk_file(path, cache_dir, chunk_size, chunk_overlap)
+        except OSError as e:
+            logger.warning("Не удалось прочитать %s: %s", path, e)
@@ -1,4 +1,5 @@
 # Конфигурация чат-бота магистратур ИТМО
+import logging
 import os
 from pathlib import Path
 from dotenv import load_dotenv
@@ -20,16 +21,79 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 # RAG
 RAG_TOP_K = 5
 EMBEDDING_MODEL = "text-embedding-3-small"
-EMBEDDING_DIM = 1536
+# Родная размерность модели; EMBEDDING_DIM можно уменьшить (параметр dimensions у text-embedding-3)
+EMBEDDING_MODEL_DIM = 1536
+EMBEDDING_DIM = int(os.getenv("EMBEDDING_DIM", str(EMBEDDING_MODEL_DIM)))
 CHAT_MODEL = "gpt-4o-mini"
 CHUNK_SIZE = 800
 CHUNK_OVERLAP = 150
+# Кэш чанков по файлам (ключ — хэш содержимого и настройки чанкинга)
+CHUNK_CACHE_DIR = DATA_DIR / ".chunk_cache"
+# Размер пачки точек при загрузке в Qdrant
+UPSERT_BATCH_SIZE = 64
+# Переносимый бандл индекса (чанки + векторы + манифест): собирается run_build_rag_index.py,
+# при старте бота загружается в Qdrant без запросов к embeddings API
+INDEX_BUNDLE_DIR = Path(os.getenv("INDEX_BUNDLE_DIR") or DATA_DIR / "index_bundle")
+# Микробатчинг эмбеддингов вопросов: окно ожидания (мс) и максимальный размер пачки
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
 
 # Qdrant
 QDRANT_HOST = os.getenv("QDRANT_HOST", "localhost")
 QDRANT_PORT = int(os.getenv("QDRANT_PORT", "6333"))
 QDRANT_COLLECTION = os.getenv("QDRANT_COLLECTION", "aith_chatbot")
+# Транспорт: gRPC (порт 6334) вместо REST — векторы передаются в protobuf, а не JSON
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+QDRANT_PREFER_GRPC = os.getenv("QDRANT_PREFER_GRPC", "").lower() in ("1", "true", "yes")
+# Асинхронный клиент (AsyncQdrantClient) для поиска из бота вместо синхронного в потоке
+QDRANT_ASYNC = os.getenv("QDRANT_ASYNC", "").lower() in ("1", "true", "yes")
+# Таймаут запросов (с) и размер пула соединений/каналов (0 — по умолчанию клиента)
+QDRANT_TIMEOUT = int(os.getenv("QDRANT_TIMEOUT", "10"))
+QDRANT_POOL_SIZE = int(os.getenv("QDRANT_POOL_SIZE", "0"))
+# Встроенный Qdrant без сервера: ":memory:" или путь к каталогу (пусто — подключение к QDRANT_HOST)
+QDRANT_LOCATION = os.getenv("QDRANT_LOCATION", "")
+# Квантование векторов: "" (float32, по умолчанию), "int8" (scalar) или "binary".
+# Квантованный индекс держится в RAM, исходные векторы — на диске и используются для rescoring.
+QUANTIZATION_MODES = ("", "int8", "binary")
+QDRANT_QUANTIZATION = os.getenv("QDRANT_QUANTIZATION", "").strip().lower()
+if QDRANT_QUANTIZATION not in QUANTIZATION_MODES:
+    logging.getLogger(__name__).warning(
+        "Неизвестный режим квантования QDRANT_QUANTIZATION=%r, используется float32", QDRANT_QUANTIZATION
+    )
+    QDRANT_QUANTIZATION = ""
+# Во сколько раз больше кандидатов брать из квантованного индекса перед rescoring
+QDRANT_OVERSAMPLING = float(os.getenv("QDRANT_OVERSAMPLING", "2.0"))
 
 # URL страниц магистратур для парсинга
 URL_AI = "https://abit.itmo.ru/program/master/ai"
 URL_AI_PRODUCT = "https://abit.itmo.ru/program/master/ai_product"
+
+# Реестр программ для парсера: program_id -> URL (program_id = имя файла data/{id}.md и source в RAG)
+PROGRAM_URLS = {
+    "ai": URL_AI,
+    "ai_product": URL_AI_PRODUCT,
+}
+
+# Метрики и трассировка
+# Порт HTTP-эндпоинта /metrics в формате Prometheus (0 — выключен)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# Файл JSONL для трейсов медленных запросов (пусто — не писать) и порог в миллисекундах
+SLOW_TRACE_PATH = os.getenv("SLOW_TRACE_PATH", "")
+SLOW_TRACE_THRESHOLD_MS = float(os.getenv("SLOW_TRACE_THRESHOLD_MS", "3000"))
+
+# Доставка ответов в Telegram: сообщений в секунду на чат (и подряд без паузы), всего на бота,
+# повторы при сетевых ошибках; 0 в *_RATE — без ограничения
+DELIVERY_CHAT_RATE = float(os.getenv("DELIVERY_CHAT_RATE", "1"))
+DELIVERY_CHAT_BURST = float(os.getenv("DELIVERY_CHAT_BURST", "3"))
+DELIVERY_GLOBAL_RATE = float(os.getenv("DELIVERY_GLOBAL_RATE", "25"))
+DELIVERY_MAX_RETRIES = int(os.getenv("DELIVERY_MAX_RETRIES", "3"))
+# Окно склейки быстрых сообщений пользователя в один вопрос, мс (0 — без ожидания)
+DEBOUNCE_WINDOW_MS = float(os.getenv("DEBOUNCE_WINDOW_MS", "300"))
+
+# Профилирование по требованию: доля профилируемых апдейтов (0 — выключено), интервал сэмплирования стеков,
+# каталог для collapsed-стеков и снимков tracemalloc
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", str(BASE_DIR / "profiles")))
+# Telegram user id администраторов через запятую (команда /profile)
+ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").replace(" ", "").split(",") if x}
@@ -0,0 +1,106 @@
+"""
+Склейка вопроса из нескольких сообщений: фрагменты одного пользователя, пришедшие с паузой
+меньше окна, объединяются в один вопрос. Если пользователь дописал вопрос, пока готовится
+ответ на предыдущую часть, этот ответ отменяется и вопрос обрабатывается заново целиком —
+одна проверка релевантности, один поиск, одна генерация и один save_turn на вопрос.
+"""
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Optional
+
+from .metrics import inc
+
+logger = logging.getLogger(__name__)
+
+
+class Superseded(asyncio.CancelledError):
+    """Вопрос дополнен новым фрагментом — ответ на предыдущую часть больше не нужен."""
+
+
+@dataclass
+class _Pending:
+    parts: list[str] = field(default_factory=list)
+    # Номер последнего фрагмента (уникален в пределах debouncer): ответ готовит только его обработчик
+    generation: int = 0
+    task: Optional[asyncio.Task] = None
+
+
+class QuestionDebouncer:
+    """
+    Окно склейки на пользователя. Обработчик сообщения вызывает collect(); получив вопрос
+    (а не None), выполняет ответ через run() и вызывает commit() перед отправкой ответа.
+    window_ms=0 — без ожидания (склейка только через отмену ответа на неполный вопрос).
+    """
+
+    def __init__(self, window_ms: float = 300.0):
+        self.window = max(0.0, window_ms) / 1000
+        self._pending: dict[int, _Pending] = {}
+        self._generations = itertools.count(1)
+
+    async def collect(self, user_id: int, text: str) -> Optional[str]:
+        """
+        Добавляет фрагмент и ждёт окно. Возвращает объединённый вопрос, если за окно
+        новых фрагментов не было; иначе None — фрагмент войдёт в вопрос более позднего сообщения.
+        """
+        pending = self._pending.setdefault(user_id, _Pending())
+        pending.parts.append(text)
+        pending.generation = next(self._generations)
+        generation = pending.generation
+        if pending.task is not None:
+            # Ответ на неполный вопрос больше не нужен
+            pending.task.cancel()
+            pending.task = None
+            inc("debounced_messages_total", help_text="Склеенные и отменённые вопросы", outcome="superseded")
+        if self.window:
+            await asyncio.sleep(self.window)
+        if self._pending.get(user_id) is not pending or pending.generation != generation:
+            inc("debounced_messages_total", help_text="Склеенные и отменённые вопросы", outcome="merged")
+            return None
+        return "\n".join(pending.parts)
+
+    def generation(self, user_id: int) -> Optional[int]:
+        """Номер текущего вопроса пользователя (после collect и до commit), иначе None."""
+        pending = self._pending.get(user_id)
+        return pending.generation if pending else None
+
+    def is_current(self, user_id: int, generation: int) -> bool:
+        """
+        Вопрос с этим номером ещё не дополнен новым фрагментом. Безопасно вызывать из рабочего
+        потока: чтение номера — одна операция под GIL. После commit возвращает False.
+        """
+        pending = self._pending.get(user_id)
+        return pending is not None and pending.generation == generation
+
+    async def run(self, user_id: int, answer: Awaitable[None]) -> None:
+        """
+        Выполняет ответ на вопрос отдельной задачей, которую отменит следующий фрагмент
+        того же пользователя (до commit). Отмена из-за нового фрагмента не считается ошибкой.
+        """
+        pending = self._pending.get(user_id)
+        if pending is None:
+            await answer
+            return
+        generation = pending.generation
+        task = asyncio.ensure_future(answer)
+        pending.task = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if pending.generation == generation:
+                # Отменён сам обработчик (остановка бота), а не вопрос
+                raise
+            logger.info("Пользователь %s дополнил вопрос, ответ на предыдущую часть отменён", user_id)
+        finally:
+            if pending.task is task:
+                pending.task = None
+            if pending.generation == generation and self._pending.get(user_id) is pending:
+                del self._pending[user_id]
+
+    def commit(self, user_id: int) -> None:
+        """
+        Ответ уходит пользователю: вопрос больше не отменяется, а следующие сообщения
+        начинают новый вопрос. Вызывается без await между ним и отправкой ответа.
+        """
+        self._pending.pop(user_id, None)
@@ -0,0 +1,290 @@
+"""
+Исходящие сообщения в Telegram: очередь доставки с ограничением частоты по чату и общим,
+паузой на время flood control (RetryAfter), повторами при сетевых ошибках и разбиением
+длинных ответов (> 4096 символов) по границам, не ломающим Markdown.
+Обработчик только ставит ответ в очередь и сразу освобождается; сообщения одного чата
+уходят строго по порядку.
+Доставка — не более одного раза: при таймауте (TimedOut) запрос мог дойти до Telegram,
+поэтому он не повторяется, чтобы пользователь не получил ответ дважды.
+"""
+import asyncio
+import contextvars
+import logging
+import re
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Awaitable, Callable, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from .metrics import count_error, observe, span
+
+logger = logging.getLogger(__name__)
+
+# Лимит длины текста сообщения Bot API
+TELEGRAM_MESSAGE_LIMIT = 4096
+_FENCE = "```"
+# Разделители для разбиения в порядке предпочтения: абзац, строка, слово
+_SEPARATORS = ("\n\n", "\n", " ")
+# Сколько ближайших к лимиту позиций каждого разделителя проверять на баланс разметки
+_CUT_CANDIDATES = 32
+# Сколько ограничителей чатов держать, прежде чем удалять неактивные
+MAX_IDLE_BUCKETS = 1024
+QUEUE_WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Экранирование разметки (как в telegram.helpers.escape_markdown) — снимается, если Telegram
+# не разобрал разметку и текст уходит без parse_mode
+_ESCAPED = {
+    "markdown": re.compile(r"\\([_*`\[])"),
+    "markdownv2": re.compile(r"\\([\\_*\[\]()~`>#+\-=|{}.!])"),
+}
+
+SendFn = Callable[..., Awaitable[object]]
+
+
+def _count_unescaped(text: str, marker: str) -> int:
+    count = 0
+    start = text.find(marker)
+    while start != -1:
+        if start == 0 or text[start - 1] != "\\":
+            count += 1
+        start = text.find(marker, start + len(marker))
+    return count
+
+
+def _fence_open(text: str) -> bool:
+    """Текст заканчивается внутри блока кода ```...```."""
+    return _count_unescaped(text, _FENCE) % 2 == 1
+
+
+def _markup_balanced(text: str) -> bool:
+    """Вне блоков кода у каждого маркера *, _, ` есть пара (экранированные \\* не считаются)."""
+    outside = "".join(text.split(_FENCE)[0::2])
+    return all(_count_unescaped(outside, m) % 2 == 0 for m in ("*", "_", "`"))
+
+
+def _find_cut(text: str, limit: int) -> int:
+    """
+    Позиция разреза text[:cut] в пределах limit: предпочтительно по абзацу, затем по строке,
+    затем по пробелу — с закрытыми *, _, `. Если такой нет — ближайший к лимиту разделитель,
+    в крайнем случае — жёсткий разрез (не посреди экранирования).
+    """
+    window = text[:limit]
+    fallback = 0
+    for sep in _SEPARATORS:
+        pos = window.rfind(sep)
+        for _ in range(_CUT_CANDIDATES):
+            if pos <= 0:
+                break
+            if text[pos - 1] != "\\":
+                if _markup_balanced(text[:pos]):
+                    return pos
+                fallback = fallback or pos
+            pos = window.rfind(sep, 0, pos)
+    if fallback:
+        return fallback
+    # Нечётное число \ подряд перед разрезом — последний экранирует следующий символ: пару не разрываем
+    cut = limit
+    run = len(window) - len(window.rstrip("\\"))
+    if run % 2 and cut > 1:
+        cut -= 1
+    return cut
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    """
+    Делит текст на части не длиннее limit. Блок кода, попавший на разрез, закрывается
+    в конце части и открывается заново в следующей.
+    """
+    pieces = []
+    rest = text
+    while len(rest) > limit:
+        # Запас на закрытие блока кода
+        cut = _find_cut(rest, limit - len(_FENCE) - 1)
+        piece, rest = rest[:cut].rstrip(), rest[cut:].lstrip("\n ")
+        if _fence_open(piece):
+            piece += "\n" + _FENCE
+            rest = _FENCE + "\n" + rest
+        if piece:
+            pieces.append(piece)
+    if rest.strip():
+        pieces.append(rest)
+    return pieces
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты: в среднем rate событий в секунду, до burst подряд.
+    rate <= 0 — без ограничения. pause(s) запрещает события на s секунд (flood control).
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        """Ведро полное и без паузы — состояние можно не хранить."""
+        now = time.monotonic()
+        if self.rate > 0:
+            self._refill(now)
+        return now >= self._paused_until and (self.rate <= 0 or self._tokens >= self.burst)
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            if self.rate <= 0:
+                return
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class _Outgoing:
+    send: SendFn
+    text: str
+    kwargs: dict
+    enqueued: float = field(default_factory=time.perf_counter)
+
+
+def _plain_text(text: str, parse_mode: Optional[str]) -> str:
+    """Текст для отправки без parse_mode: экранированные символы разметки — как в исходном тексте."""
+    pattern = _ESCAPED.get((parse_mode or "").lower())
+    return pattern.sub(r"\1", text) if pattern else text
+
+
+def _retry_after_seconds(value: int | float | timedelta) -> float:
+    # python-telegram-bot 22 отдаёт timedelta или число секунд (в зависимости от настроек)
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class DeliveryQueue:
+    """
+    Очередь исходящих сообщений: по одному обработчику на чат с неотправленными сообщениями
+    (порядок внутри чата сохраняется), общий лимит на все чаты.
+    send — корутина вида message.reply_text(text, **kwargs).
+    """
+
+    def __init__(
+        self,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        global_rate: float = 25.0,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0,
+    ):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._global = TokenBucket(global_rate, global_rate)
+        self._queues: dict[int, deque[_Outgoing]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self._buckets: dict[int, TokenBucket] = {}
+
+    def submit(self, chat_id: int, send: SendFn, text: str, **kwargs) -> int:
+        """Ставит ответ в очередь чата (длинный — несколькими сообщениями); возвращает число частей."""
+        pieces = split_message(text)
+        queue = self._queues.setdefault(chat_id, deque())
+        queue.extend(_Outgoing(send, piece, dict(kwargs)) for piece in pieces)
+        if chat_id not in self._workers:
+            if len(self._buckets) > MAX_IDLE_BUCKETS:
+                self._prune_buckets()
+            # Пустой контекст: доставка не относится к трейсу запроса, который её запустил
+            self._workers[chat_id] = contextvars.Context().run(
+                asyncio.get_running_loop().create_task,
+                self._run(chat_id, queue),
+                name=f"delivery-{chat_id}",
+            )
+        return len(pieces)
+
+    def _prune_buckets(self) -> None:
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._workers and b.idle()]:
+            del self._buckets[chat_id]
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def join(self, timeout: Optional[float] = None) -> None:
+        """Ждёт доставки всего, что уже в очереди (при остановке бота, в бенчмарке)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._workers:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                logger.warning("Не доставлено сообщений при остановке: %d", self.pending())
+                return
+            await asyncio.wait(list(self._workers.values()), timeout=remaining)
+
+    async def _run(self, chat_id: int, queue: deque[_Outgoing]) -> None:
+        bucket = self._buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        try:
+            while queue:
+                await self._deliver(chat_id, bucket, queue[0])
+                queue.popleft()
+        finally:
+            # Между последней проверкой queue и этим местом нет await — новые сообщения не теряются
+            del self._workers[chat_id]
+            del self._queues[chat_id]
+            if bucket.idle():
+                del self._buckets[chat_id]
+
+    async def _deliver(self, chat_id: int, bucket: TokenBucket, item: _Outgoing) -> None:
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._global.acquire()
+            if attempt == 0:
+                observe(
+                    "telegram_queue_wait_seconds", time.perf_counter() - item.enqueued,
+                    "Ожидание сообщения в очереди доставки", buckets=QUEUE_WAIT_BUCKETS,
+                )
+            try:
+                # Flood control и таймаут считаются своими счётчиками, не ошибками telegram_send
+                with span("telegram_send", expected=(RetryAfter, TimedOut)):
+                    await item.send(item.text, **item.kwargs)
+                return
+            except RetryAfter as e:
+                # Flood control касается бота целиком: пауза для всех чатов, попытка не расходуется
+                delay = _retry_after_seconds(e.retry_after)
+                count_error("telegram_flood_wait")
+                logger.warning("Flood control Telegram: пауза %.1f с (чат %s)", delay, chat_id)
+                self._global.pause(delay)
+                continue
+            except BadRequest as e:
+                if item.kwargs.get("parse_mode") and "parse entities" in str(e).lower():
+                    # Разметка не разобралась — отправляем исходный текст (без \-экранирования) без parse_mode
+                    logger.warning("Markdown не принят Telegram (чат %s), отправка без разметки", chat_id)
+                    item.text = _plain_text(item.text, item.kwargs.pop("parse_mode"))
+                    continue
+                logger.warning("Сообщение в чат %s отклонено: %s", chat_id, e)
+                return
+            except TimedOut as e:
+                # Сообщение могло быть доставлено — повтор рискует продублировать ответ
+                count_error("telegram_send_timeout")
+                logger.warning("Таймаут отправки в чат %s, сообщение не повторяется: %s", chat_id, e)
+                return
+            except NetworkError as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    logger.warning("Сообщение в чат %s не доставлено после %d попыток: %s", chat_id, attempt, e)
+                    return
+                await asyncio.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            except Exception as e:
+                logger.exception("Ошибка отправки в чат %s: %s", chat_id, e)
+                return
@@ -1,38 +1,65 @@
 """
 Хранение истории диалога через LangChain: последние 2–3 обмена с суммаризацией старых сообщений.
+LangChain импортируется лениво (при первом обращении к памяти или в warm_up), чтобы не замедлять
+импорт бота.
 """
 import logging
-
-try:
-    from langchain.memory import ConversationSummaryBufferMemory
-except ImportError:
-    from langchain_community.memory import ConversationSummaryBufferMemory  # noqa: F401
-
-from langchain_openai import ChatOpenAI
+from typing import TYPE_CHECKING, Optional
 
 from .config import CHAT_MODEL
+from .metrics import count_cache, span
+
+if TYPE_CHECKING:
+    from langchain.memory import ConversationSummaryBufferMemory
+    from langchain_openai import ChatOpenAI
 
 logger = logging.getLogger(__name__)
 
 # Память на пользователя (user_id -> ConversationSummaryBufferMemory)
-_user_memories: dict[int, ConversationSummaryBufferMemory] = {}
+_user_memories: dict[int, "ConversationSummaryBufferMemory"] = {}
 
 # Лимит токенов в буфере до суммаризации; оставляем ~2–3 последних обмена
 MAX_TOKEN_LIMIT = 400
 
+_llm: Optional["ChatOpenAI"] = None
+
 
-def _get_llm() -> ChatOpenAI:
-    """LLM для суммаризации и для памяти."""
-    return ChatOpenAI(model=CHAT_MODEL, temperature=0)
+def _memory_class():
+    """Класс ConversationSummaryBufferMemory из доступной версии LangChain."""
+    try:
+        from langchain.memory import ConversationSummaryBufferMemory
+    except ImportError:
+        try:
+            from langchain_community.memory import ConversationSummaryBufferMemory
+        except ImportError:
+            # langchain 1.x: устаревшая память перенесена в langchain-classic
+            from langchain_classic.memory import ConversationSummaryBufferMemory
+    return ConversationSummaryBufferMemory
 
 
-def get_memory(user_id: int) -> ConversationSummaryBufferMemory:
+def _get_llm() -> "ChatOpenAI":
+    """LLM для суммаризации и для памяти (один клиент и пул соединений на всех пользователей)."""
+    global _llm
+    if _llm is None:
+        from langchain_openai import ChatOpenAI
+
+        _llm = ChatOpenAI(model=CHAT_MODEL, temperature=0)
+    return _llm
+
+
+def warm_up() -> None:
+    """Импортирует LangChain и создаёт LLM заранее, чтобы первый пользователь не ждал."""
+    _memory_class()
+    _get_llm()
+
+
+def get_memory(user_id: int) -> "ConversationSummaryBufferMemory":
     """
     Возвращает память диалога для пользователя.
     Хранит последние сообщения и суммаризирует старые при переполнении.
     """
     if user_id not in _user_memories:
-        _user_memories[user_id] = ConversationSummaryBufferMemory(
+        _user_memories[user_id] = _memory_class()(
             llm=_get_llm(),
             max_token_limit=MAX_TOKEN_LIMIT,
             return_messages=False,
@@ -46,9 +73,11 @@ def get_history_for_prompt(user_id: int) -> str:
     Возвращает строку истории (суммаризация + последние 2–3 обмена) для вставки в промпт.
     Вызывать до добавления текущего сообщения пользователя.
     """
+    count_cache("history_memory", user_id in _user_memories)
     memory = get_memory(user_id)
     try:
-        vars_ = memory.load_memory_variables({})
+        with span("history_load"):
+            vars_ = memory.load_memory_variables({})
         return (vars_.get("history") or "").strip()
     except Exception as e:
         logger.warning("Ошибка загрузки истории для user_id=%s: %s", user_id, e)
@@ -59,9 +88,11 @@ def save_turn(user_id: int, user_message: str, assistant_message: str) -> None:
     """Сохраняет один обмен (вопрос пользователя и ответ ассистента) в историю."""
     memory = get_memory(user_id)
     try:
-        memory.save_context(
-            {"input": user_message},
-            {"output": assistant_message},
-        )
+        # При переполнении буфера save_context суммаризирует старые сообщения через LLM
+        with span("summarization"):
+            memory.save_context(
+                {"input": user_message},
+                {"output": assistant_message},
+            )
     except Exception as e:
         logger.warning("Ошибка сохранения истории для user_id=%s: %s", user_id, e)
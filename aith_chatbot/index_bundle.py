@@ -0,0 +1,280 @@
+"""
+Переносимый бандл индекса RAG в INDEX_BUNDLE_DIR:
+  manifest.json — версия формата, модель и размерность эмбеддингов, настройки чанкинга,
+                  хэши исходных data/*.md и файлов бандла, число чанков;
+  chunks.jsonl  — чанки (text, source, headings, hash) в порядке строк vectors.npy;
+  vectors.npy   — float32 [n, dim], читается через mmap без копирования в память.
+Бандл собирается один раз (run_build_rag_index.py) и при старте бота загружается в Qdrant
+без запросов к embeddings API. При пересборке векторы неизменённых чанков берутся из прошлого бандла.
+"""
+import hashlib
+import json
+import logging
+import shutil
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import grpc
+import numpy as np
+from qdrant_client.http.exceptions import ResponseHandlingException, UnexpectedResponse
+
+from .chunking import CHUNKER_VERSION, SECTION_DEPTH, iter_chunks
+from .config import (
+    CHUNK_CACHE_DIR,
+    CHUNK_OVERLAP,
+    CHUNK_SIZE,
+    DATA_DIR,
+    EMBEDDING_DIM,
+    EMBEDDING_MODEL,
+    INDEX_BUNDLE_DIR,
+    QDRANT_COLLECTION,
+    UPSERT_BATCH_SIZE,
+)
+from .rag import (
+    _embedding_input,
+    build_index,
+    ensure_collection,
+    ensure_source_index,
+    get_embeddings,
+    get_qdrant_client,
+    has_index,
+    upload_chunks,
+)
+
+logger = logging.getLogger(__name__)
+
+# Меняется при несовместимом изменении формата файлов бандла
+BUNDLE_FORMAT_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+CHUNKS_NAME = "chunks.jsonl"
+VECTORS_NAME = "vectors.npy"
+
+# Ошибки, при которых бандл не загружен и индекс собирается с эмбеддингами
+RESTORE_ERRORS = (OSError, ValueError, UnexpectedResponse, ResponseHandlingException, grpc.RpcError)
+
+
+class StaleBundleError(ValueError):
+    """data/*.md изменились после сборки бандла — его чанки устарели."""
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def source_hashes(data_dir: Path = DATA_DIR) -> dict[str, str]:
+    """SHA-256 исходных data/*.md по имени источника."""
+    return {path.stem: _sha256_file(path) for path in sorted(data_dir.glob("*.md"))}
+
+
+def sources_id(hashes: dict[str, str]) -> str:
+    """Короткий идентификатор версии data/*.md (пишется в payload точек как sources_id)."""
+    return hashlib.sha256(json.dumps(hashes, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _chunk_hash(chunk: dict) -> str:
+    return hashlib.sha256(_embedding_input(chunk).encode("utf-8")).hexdigest()
+
+
+def load_manifest(bundle_dir: Path = INDEX_BUNDLE_DIR) -> Optional[dict]:
+    """Манифест бандла или None, если бандла нет."""
+    path = bundle_dir / MANIFEST_NAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _incompatibility(manifest: dict) -> Optional[str]:
+    """Причина, по которой бандл нельзя использовать с текущей конфигурацией, или None."""
+    if manifest.get("format_version") != BUNDLE_FORMAT_VERSION:
+        return f"формат {manifest.get('format_version')}, ожидается {BUNDLE_FORMAT_VERSION}"
+    if manifest.get("embedding_model") != EMBEDDING_MODEL or manifest.get("dim") != EMBEDDING_DIM:
+        return (
+            f"эмбеддинги {manifest.get('embedding_model')}/{manifest.get('dim')}, "
+            f"в конфигурации {EMBEDDING_MODEL}/{EMBEDDING_DIM}"
+        )
+    return None
+
+
+def _read_chunks(bundle_dir: Path) -> list[dict]:
+    with open(bundle_dir / CHUNKS_NAME, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _reusable_vectors(bundle_dir: Path) -> dict[str, np.ndarray]:
+    """Векторы прошлого совместимого бандла: хэш входа эмбеддинга -> вектор."""
+    try:
+        manifest = load_manifest(bundle_dir)
+        if not manifest or _incompatibility(manifest):
+            return {}
+        vectors = np.load(bundle_dir / VECTORS_NAME, mmap_mode="r")
+        return {c["hash"]: vectors[i] for i, c in enumerate(_read_chunks(bundle_dir))}
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        logger.warning("Прошлый бандл индекса не прочитан, все чанки эмбеддятся заново: %s", e)
+        return {}
+
+
+def export_bundle(bundle_dir: Path = INDEX_BUNDLE_DIR, data_dir: Path = DATA_DIR) -> dict:
+    """
+    Собирает бандл из data/*.md: чанки, эмбеддинги (только для чанков, которых нет в прошлом
+    бандле) и манифест. Бандл пишется во временный каталог и заменяет прежний целиком.
+    Возвращает манифест.
+    """
+    chunks = list(iter_chunks(data_dir, cache_dir=data_dir / CHUNK_CACHE_DIR.name))
+    if not chunks:
+        raise ValueError(f"Нет чанков в {data_dir}: запустите scraper")
+    for chunk in chunks:
+        chunk["hash"] = _chunk_hash(chunk)
+    previous = _reusable_vectors(bundle_dir)
+    tmp_dir = bundle_dir.with_name(bundle_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    try:
+        vectors = np.lib.format.open_memmap(
+            tmp_dir / VECTORS_NAME, mode="w+", dtype=np.float32, shape=(len(chunks), EMBEDDING_DIM)
+        )
+        missing = []
+        for i, chunk in enumerate(chunks):
+            if chunk["hash"] in previous:
+                vectors[i] = previous[chunk["hash"]]
+            else:
+                missing.append(i)
+        for start in range(0, len(missing), UPSERT_BATCH_SIZE):
+            rows = missing[start:start + UPSERT_BATCH_SIZE]
+            vectors[rows] = np.asarray(
+                get_embeddings([_embedding_input(chunks[i]) for i in rows]), dtype=np.float32
+            )
+        vectors.flush()
+        del vectors, previous
+        with open(tmp_dir / CHUNKS_NAME, "w", encoding="utf-8") as f:
+            for chunk in chunks:
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+        files = {name: _sha256_file(tmp_dir / name) for name in (CHUNKS_NAME, VECTORS_NAME)}
+        manifest = {
+            "format_version": BUNDLE_FORMAT_VERSION,
+            "bundle_id": hashlib.sha256("".join(files.values()).encode()).hexdigest()[:16],
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "embedding_model": EMBEDDING_MODEL,
+            "dim": EMBEDDING_DIM,
+            "distance": "cosine",
+            "count": len(chunks),
+            "chunking": {
+                "chunk_size": CHUNK_SIZE,
+                "chunk_overlap": CHUNK_OVERLAP,
+                "section_depth": SECTION_DEPTH,
+                "chunker_version": CHUNKER_VERSION,
+            },
+            "sources": source_hashes(data_dir),
+            "files": files,
+        }
+        (tmp_dir / MANIFEST_NAME).write_text(
+            json.dumps(manifest, ensure_ascii=False, indent=2), encoding="utf-8"
+        )
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    shutil.rmtree(bundle_dir, ignore_errors=True)
+    tmp_dir.rename(bundle_dir)
+    logger.info(
+        "Бандл индекса %s: %d чанков, эмбеддингов запрошено %d → %s",
+        manifest["bundle_id"], len(chunks), len(missing), bundle_dir,
+    )
+    return manifest
+
+
+def load_bundle(bundle_dir: Path = INDEX_BUNDLE_DIR) -> tuple[dict, list[dict], np.ndarray]:
+    """
+    Читает и проверяет бандл: совместимость с конфигурацией, хэши файлов, размеры.
+    Возвращает (манифест, чанки, векторы через mmap). ValueError — бандл непригоден.
+    """
+    manifest = load_manifest(bundle_dir)
+    if manifest is None:
+        raise FileNotFoundError(f"Нет бандла индекса в {bundle_dir}")
+    problem = _incompatibility(manifest)
+    if problem:
+        raise ValueError(f"Бандл индекса несовместим: {problem}")
+    for name, digest in manifest["files"].items():
+        if _sha256_file(bundle_dir / name) != digest:
+            raise ValueError(f"Бандл индекса повреждён: хэш {name} не совпадает с манифестом")
+    chunks = _read_chunks(bundle_dir)
+    vectors = np.load(bundle_dir / VECTORS_NAME, mmap_mode="r")
+    if vectors.shape != (manifest["count"], manifest["dim"]) or len(chunks) != manifest["count"]:
+        raise ValueError(f"Бандл индекса повреждён: {len(chunks)} чанков, векторы {vectors.shape}")
+    return manifest, chunks, vectors
+
+
+def _indexed_value(client, key: str) -> Optional[str]:
+    """
+    Поле key (bundle_id, sources_id) из payload точек коллекции
+    (None — коллекции нет или точки загружены без этого поля).
+    """
+    try:
+        points, _ = client.scroll(QDRANT_COLLECTION, limit=1, with_payload=[key])
+        return (points[0].payload or {}).get(key) if points else None
+    except Exception:
+        return None
+
+
+def restore_bundle(
+    bundle_dir: Path = INDEX_BUNDLE_DIR,
+    force: bool = False,
+    data_dir: Path = DATA_DIR,
+) -> int:
+    """
+    Загружает бандл в Qdrant одной пакетной загрузкой, без запросов к embeddings API.
+    Если в коллекции уже этот бандл (по bundle_id) — ничего не делает, если не force.
+    StaleBundleError — бандл собран по другой версии data/*.md.
+    Возвращает число загруженных точек (0 — загрузка не понадобилась).
+    """
+    start = time.perf_counter()
+    manifest, chunks, vectors = load_bundle(bundle_dir)
+    sources = source_hashes(data_dir)
+    if manifest["sources"] != sources:
+        raise StaleBundleError(
+            "data/*.md изменились после сборки бандла индекса — пересоберите: python run_build_rag_index.py"
+        )
+    client = get_qdrant_client()
+    if not force and _indexed_value(client, "bundle_id") == manifest["bundle_id"] and has_index():
+        logger.info("Индекс в Qdrant уже загружен из бандла %s", manifest["bundle_id"])
+        return 0
+    if client.collection_exists(QDRANT_COLLECTION):
+        client.delete_collection(QDRANT_COLLECTION)
+    ensure_collection(dim=manifest["dim"])
+    ensure_source_index()
+    upload_chunks(client, chunks, vectors, bundle_id=manifest["bundle_id"], sources_id=sources_id(sources))
+    logger.info(
+        "Индекс загружен из бандла %s: %d чанков за %.2f с",
+        manifest["bundle_id"], len(chunks), time.perf_counter() - start,
+    )
+    return len(chunks)
+
+
+def restore_or_build_index(bundle_dir: Path = INDEX_BUNDLE_DIR, data_dir: Path = DATA_DIR) -> int:
+    """
+    Индекс для бота: из бандла, если он есть, актуален и загрузился, иначе сборка с эмбеддингами.
+    Если в Qdrant уже этот бандл — возвращает 0. Устаревший бандл не приводит к пересборке,
+    если коллекция уже собрана по текущим data/*.md (sources_id в payload) — тоже 0.
+    """
+    current = sources_id(source_hashes(data_dir))
+    if load_manifest(bundle_dir) is not None:
+        try:
+            return restore_bundle(bundle_dir, data_dir=data_dir)
+        except StaleBundleError as e:
+            if _indexed_value(get_qdrant_client(), "sources_id") == current and has_index():
+                logger.warning("%s (индекс в Qdrant уже собран по текущим data/*.md)", e)
+                return 0
+            logger.warning("Бандл индекса устарел, сборка с эмбеддингами: %s", e)
+        except RESTORE_ERRORS as e:
+            logger.warning("Бандл индекса не загружен, сборка с эмбеддингами: %s", e)
+    return build_index(force=True, sources_id=current)
+
+
+def warm_up() -> None:
+    """При старте бота загружает бандл индекса в Qdrant (устаревший — пересобирает индекс)."""
+    if load_manifest() is not None:
+        restore_or_build_index()
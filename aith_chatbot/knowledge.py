@@ -4,6 +4,7 @@
 """
 import json
 import re
+from functools import lru_cache
 from typing import Optional
 
 from .config import DATA_DIR
@@ -23,9 +24,16 @@ IRRELEVANT_PATTERNS = [
     r"\b(погода|курс\s+валют|рецепт)\b",
 ]
 
+# Признаки конкретной программы в тексте вопроса (для фильтрации RAG по source)
+PROGRAM_PATTERNS = {
+    "ai_product": [r"ai[\s_-]?product", r"ai[\s_-]?продукт", r"продукт\w*\s+и\s+технолог"],
+    "ai": [r"искусственн\w*\s+интеллект", r"/master/ai\b", r"программ\w*\s+[«\"]?ai\b(?![-\s]*(product|продукт))"],
+}
 
+
+@lru_cache(maxsize=1)
 def load_programs() -> list[dict]:
-    """Загружает данные программ из data/programs.json."""
+    """Загружает данные программ из data/programs.json (читается один раз за процесс)."""
     path = DATA_DIR / "programs.json"
     if not path.exists():
         return []
@@ -33,8 +41,9 @@ def load_programs() -> list[dict]:
         return json.load(f)
 
 
+@lru_cache(maxsize=1)
 def load_knowledge() -> dict:
-    """Загружает сжатый текст для ответов из data/knowledge.json."""
+    """Загружает сжатый текст для ответов из data/knowledge.json (читается один раз за процесс)."""
     path = DATA_DIR / "knowledge.json"
     if not path.exists():
         return {}
@@ -61,6 +70,19 @@ def is_relevant(user_text: str) -> bool:
     return False
 
 
+def detect_program(user_text: str) -> Optional[str]:
+    """
+    Определяет, о какой программе вопрос: 'ai', 'ai_product' или None.
+    None — если программа не упомянута или упомянуты обе (например, сравнение).
+    """
+    text = user_text.lower()
+    found = [
+        pid for pid, patterns in PROGRAM_PATTERNS.items()
+        if any(re.search(p, text) for p in patterns)
+    ]
+    return found[0] if len(found) == 1 else None
+
+
 def get_context_for_answer(program_ids: Optional[list[str]] = None) -> str:
     """Собирает текстовый контекст из базы знаний для ответа (все программы или выбранные)."""
     knowledge = load_knowledge()
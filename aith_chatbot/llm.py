@@ -8,6 +8,7 @@ from typing import Optional
 from openai import OpenAI
 
 from .config import CHAT_MODEL
+from .metrics import count_usage, span
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +25,11 @@ def _get_client() -> OpenAI:
     return _client
 
 
+def warm_up() -> None:
+    """Создаёт клиент и открывает соединение с OpenAI до первого вопроса."""
+    _get_client().with_options(max_retries=0, timeout=10).models.retrieve(CHAT_MODEL)
+
+
 RELEVANCE_SYSTEM = """Ты классификатор. Твоя задача — определить, относится ли вопрос пользователя к двум магистерским программам ИТМО:
 1) «Искусственный интеллект» (abit.itmo.ru/program/master/ai)
 2) «AI-продукты и технологии» (abit.itmo.ru/program/master/ai_product)
@@ -55,15 +61,17 @@ def generate_answer_rag_with_history(
     user_content = "\n\n".join(parts)
     try:
         client = _get_client()
-        r = client.chat.completions.create(
-            model=CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": system},
-                {"role": "user", "content": user_content},
-            ],
-            max_tokens=1024,
-            temperature=0.3,
-        )
+        with span("completion"):
+            r = client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": system},
+                    {"role": "user", "content": user_content},
+                ],
+                max_tokens=1024,
+                temperature=0.3,
+            )
+        count_usage("completion", r)
         return (r.choices[0].message.content or "").strip()
     except Exception as e:
         logger.warning("Ошибка LLM при генерации ответа с историей: %s", e)
@@ -82,17 +90,20 @@ def is_relevant_llm(question: str) -> bool:
         return False
     try:
         client = _get_client()
-        r = client.chat.completions.create(
-            model=CHAT_MODEL,
-            messages=[
-                {"role": "system", "content": RELEVANCE_SYSTEM},
-                {"role": "user", "content": question},
-            ],
-            max_tokens=20,
-            temperature=0,
-        )
+        with span("relevance"):
+            r = client.chat.completions.create(
+                model=CHAT_MODEL,
+                messages=[
+                    {"role": "system", "content": RELEVANCE_SYSTEM},
+                    {"role": "user", "content": question},
+                ],
+                max_tokens=20,
+                temperature=0,
+            )
+        count_usage("relevance", r)
         content = (r.choices[0].message.content or "").strip().upper()
-        return "RELEVANT" in content
+        # "IRRELEVANT" тоже содержит подстроку "RELEVANT" — сравниваем начало ответа
+        return content.startswith("RELEVANT")
     except Exception as e:
         logger.warning("Ошибка LLM при проверке релевантности: %s", e)
         return False
@@ -0,0 +1,255 @@
+"""
+Метрики и трассировка: спаны по этапам обработки запроса, счётчики токенов и кэшей,
+экспорт в формате Prometheus по HTTP и запись медленных трейсов в JSONL.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+
+from .config import SLOW_TRACE_PATH, SLOW_TRACE_THRESHOLD_MS
+
+logger = logging.getLogger(__name__)
+
+# Границы бакетов гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+# (имя метрики, tuple пар label=value) -> значение
+_counters: dict[tuple[str, tuple], float] = {}
+# (имя метрики, labels) -> [счётчики по бакетам..., +Inf], сумма
+_histograms: dict[tuple[str, tuple], tuple[list[int], float]] = {}
+# Границы бакетов по имени гистограммы (по умолчанию LATENCY_BUCKETS)
+_buckets: dict[str, tuple[float, ...]] = {}
+_help: dict[str, tuple[str, str]] = {}
+
+# Трейс текущего запроса (update_id, список спанов)
+_current_trace: ContextVar[Optional[dict]] = ContextVar("current_trace", default=None)
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _declare(name: str, kind: str, help_text: str) -> None:
+    _help.setdefault(name, (kind, help_text))
+
+
+def inc(name: str, value: float = 1.0, help_text: str = "", **labels) -> None:
+    """Увеличивает счётчик name{labels} на value."""
+    key = (name, _labels(labels))
+    with _lock:
+        _declare(name, "counter", help_text)
+        _counters[key] = _counters.get(key, 0.0) + value
+
+
+def observe(
+    name: str,
+    value: float,
+    help_text: str = "",
+    buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    **labels,
+) -> None:
+    """Добавляет наблюдение value в гистограмму name{labels} (границы бакетов — buckets)."""
+    key = (name, _labels(labels))
+    with _lock:
+        _declare(name, "histogram", help_text)
+        bounds = _buckets.setdefault(name, buckets)
+        counts, total = _histograms.get(key, ([0] * (len(bounds) + 1), 0.0))
+        for i, le in enumerate(bounds):
+            if value <= le:
+                counts[i] += 1
+        counts[-1] += 1
+        _histograms[key] = (counts, total + value)
+
+
+def count_tokens(kind: str, prompt_tokens: int = 0, completion_tokens: int = 0) -> None:
+    """Учитывает токены запроса к OpenAI (kind: relevance, completion, embedding, ...)."""
+    if prompt_tokens:
+        inc("openai_prompt_tokens_total", prompt_tokens, "Токены промпта OpenAI", kind=kind)
+    if completion_tokens:
+        inc("openai_completion_tokens_total", completion_tokens, "Токены ответа OpenAI", kind=kind)
+
+
+def count_usage(kind: str, response) -> None:
+    """Учитывает токены из поля usage ответа OpenAI (если оно есть)."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    count_tokens(
+        kind,
+        getattr(usage, "prompt_tokens", 0) or 0,
+        getattr(usage, "completion_tokens", 0) or 0,
+    )
+
+
+def count_cache(cache: str, hit: bool) -> None:
+    """Учитывает попадание или промах кэша cache."""
+    name = "cache_hits_total" if hit else "cache_misses_total"
+    inc(name, help_text="Попадания/промахи кэшей", cache=cache)
+
+
+def count_error(stage: str) -> None:
+    """Учитывает ошибку на этапе stage (ошибки, которые перехватываются и логируются)."""
+    inc("stage_errors_total", help_text="Перехваченные ошибки по этапам", stage=stage)
+
+
+@contextmanager
+def span(stage: str, expected: tuple[type[Exception], ...] = ()) -> Iterator[None]:
+    """
+    Замеряет длительность этапа stage: гистограмма stage_latency_seconds
+    и запись в трейс текущего запроса (если он открыт через request_trace).
+    Исключение внутри спана учитывается в stage_errors_total — вызывающему коду
+    считать его повторно не нужно. Отмена (asyncio.CancelledError) и исключения
+    из expected (у них свои счётчики) ошибкой этапа не считаются.
+    """
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        if not isinstance(e, expected):
+            count_error(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("stage_latency_seconds", elapsed, "Длительность этапов обработки", stage=stage)
+        trace = _current_trace.get()
+        # "_t0" нет — трейс уже закрыт (спан из фоновой задачи, пережившей запрос)
+        if trace is not None and "_t0" in trace:
+            item = {"stage": stage, "start_ms": round((start - trace["_t0"]) * 1000, 3),
+                    "duration_ms": round(elapsed * 1000, 3)}
+            if error:
+                item["error"] = error
+            trace["spans"].append(item)
+
+
+@contextmanager
+def request_trace(update_id: Optional[int], kind: str = "message") -> Iterator[dict]:
+    """
+    Открывает трейс запроса: все span() внутри попадают в него.
+    По завершении пишет request_latency_seconds; медленные запросы
+    (дольше SLOW_TRACE_THRESHOLD_MS) дописываются в SLOW_TRACE_PATH.
+    """
+    trace = {"update_id": update_id, "kind": kind, "ts": time.time(), "spans": [],
+             "_t0": time.perf_counter()}
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        elapsed = time.perf_counter() - trace.pop("_t0")
+        trace["duration_ms"] = round(elapsed * 1000, 3)
+        observe("request_latency_seconds", elapsed, "Полное время обработки апдейта", kind=kind)
+        if SLOW_TRACE_PATH and trace["duration_ms"] >= SLOW_TRACE_THRESHOLD_MS:
+            _dump_trace(trace)
+
+
+def _dump_trace(trace: dict) -> None:
+    try:
+        with _lock, open(SLOW_TRACE_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(trace, ensure_ascii=False) + "\n")
+    except OSError as e:
+        logger.warning("Не удалось записать трейс в %s: %s", SLOW_TRACE_PATH, e)
+
+
+def _escape_label_value(value: str) -> str:
+    """Экранирование значения метки по текстовому формату Prometheus: \\, " и перевод строки."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape_label_value(str(v))}"' for k, v in items) + "}"
+
+
+def render_prometheus() -> str:
+    """Текущее состояние всех метрик в текстовом формате Prometheus."""
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: (list(b), s) for k, (b, s) in _histograms.items()}
+        help_ = dict(_help)
+        bounds = dict(_buckets)
+    for name in sorted(help_):
+        kind, help_text = help_[name]
+        lines.append(f"# HELP {name} {_escape_help(help_text or name)}")
+        lines.append(f"# TYPE {name} {kind}")
+        if kind == "counter":
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        else:
+            for (n, labels), (buckets, total) in sorted(histograms.items()):
+                if n != name:
+                    continue
+                for le, count in zip(bounds.get(name, LATENCY_BUCKETS), buckets):
+                    lines.append(f"{name}_bucket{_format_labels(labels, (('le', f'{le:g}'),))} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, (('le', '+Inf'),))} {buckets[-1]}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {total:g}")
+                lines.append(f"{name}_count{_format_labels(labels)} {buckets[-1]}")
+    # Доля попаданий по каждому кэшу
+    caches = sorted({dict(labels)["cache"] for (n, labels) in counters if n in ("cache_hits_total", "cache_misses_total")})
+    if caches:
+        lines.append("# HELP cache_hit_ratio Доля попаданий кэша")
+        lines.append("# TYPE cache_hit_ratio gauge")
+        for cache in caches:
+            hits = counters.get(("cache_hits_total", (("cache", cache),)), 0.0)
+            misses = counters.get(("cache_misses_total", (("cache", cache),)), 0.0)
+            lines.append(f"cache_hit_ratio{_format_labels((('cache', cache),))} {hits / (hits + misses):g}")
+    return "\n".join(lines) + "\n"
+
+
+def histogram_summary(name: str) -> dict[str, tuple[int, float]]:
+    """Количество наблюдений и сумма по каждому набору меток гистограммы name."""
+    with _lock:
+        return {
+            ",".join(v for _, v in labels): (buckets[-1], total)
+            for (n, labels), (buckets, total) in _histograms.items()
+            if n == name
+        }
+
+
+def reset() -> None:
+    """Сбрасывает все метрики вместе с описаниями и границами бакетов (для бенчмарков и тестов)."""
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _help.clear()
+        _buckets.clear()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug("metrics: " + format, *args)
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Запускает HTTP-эндпоинт /metrics в фоновом потоке."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True)
+    thread.start()
+    logger.info("Метрики Prometheus: http://%s:%d/metrics", host, port)
+    return server
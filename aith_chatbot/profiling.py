@@ -0,0 +1,218 @@
+"""
+Профилирование отдельных апдейтов по требованию: доля запросов (PROFILE_SAMPLE_RATE или
+команда /profile) обрабатывается под сэмплирующим профилировщиком стеков и tracemalloc.
+Для каждого такого апдейта в PROFILE_DIR пишутся:
+  <update_id>.collapsed       — стеки в формате collapsed (flamegraph.pl, speedscope, inferno);
+  <update_id>.tracemalloc     — снимок аллокаций (tracemalloc.Snapshot.load);
+  <update_id>.alloc.txt       — топ мест аллокаций по объёму.
+Выключено по умолчанию: без профилирования profile_request — одна проверка числа.
+
+Стеки снимаются с потока event loop и с потоков, в которых работа апдейта запущена через
+profiling.to_thread. Ограничения: в потоке event loop видны и корутины других апдейтов,
+выполнявшиеся в момент сэмпла, а tracemalloc учитывает аллокации всего процесса.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Iterator, Optional, TypeVar
+
+from .config import PROFILE_DIR, PROFILE_INTERVAL_MS, PROFILE_SAMPLE_RATE
+from .metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# Глубина стека аллокаций в снимке tracemalloc
+TRACEMALLOC_FRAMES = 16
+ALLOC_TOP = 30
+
+T = TypeVar("T")
+
+_sample_rate = PROFILE_SAMPLE_RATE
+# tracemalloc и поток event loop общие для процесса, поэтому одновременно профилируется только один апдейт
+_active = threading.Lock()
+# Сэмплер профилируемого апдейта (наследуется его задачами и потоками to_thread)
+_current_sampler: contextvars.ContextVar[Optional["StackSampler"]] = contextvars.ContextVar(
+    "current_sampler", default=None
+)
+# Фильтрация снимка tracemalloc и запись файлов профиля — в фоновом потоке, не в event loop
+_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="profile-writer")
+
+
+def sample_rate() -> float:
+    return _sample_rate
+
+
+def set_sample_rate(rate: float) -> float:
+    """Меняет долю профилируемых апдейтов на лету (0 — выключить); возвращает новое значение."""
+    global _sample_rate
+    _sample_rate = min(1.0, max(0.0, rate))
+    logger.info("Профилирование: доля апдейтов %.3f", _sample_rate)
+    return _sample_rate
+
+
+class StackSampler(threading.Thread):
+    """
+    Фоновый поток, раз в interval секунд снимающий стеки отслеживаемых потоков
+    (sys._current_frames) и считающий одинаковые стеки. Стоимость не зависит от числа
+    вызовов функций — в отличие от cProfile, профилируемый код не замедляется.
+    """
+
+    def __init__(self, interval: float, threads: tuple[int, ...] = ()):
+        super().__init__(name="stack-sampler", daemon=True)
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        # ident потока -> сколько вызовов to_thread апдейта в нём сейчас выполняется
+        self._threads: Counter[int] = Counter(threads)
+        self._threads_lock = threading.Lock()
+        self._done = threading.Event()
+
+    def track(self, ident: int) -> None:
+        with self._threads_lock:
+            self._threads[ident] += 1
+
+    def untrack(self, ident: int) -> None:
+        with self._threads_lock:
+            self._threads[ident] -= 1
+            if self._threads[ident] <= 0:
+                del self._threads[ident]
+
+    def run(self) -> None:
+        while not self._done.wait(self.interval):
+            with self._threads_lock:
+                tracked = set(self._threads)
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident in tracked:
+                    self.samples[_collapse(names.get(ident, str(ident)), frame)] += 1
+
+    def stop(self) -> Counter[str]:
+        self._done.set()
+        self.join()
+        return self.samples
+
+
+def _collapse(thread_name: str, frame) -> str:
+    """Стек от корня к листу через ';' — строка формата collapsed stacks."""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.append(thread_name)
+    return ";".join(reversed(stack))
+
+
+def _write_profile(
+    update_id: Optional[int],
+    samples: Counter[str],
+    snapshot: tracemalloc.Snapshot,
+    out_dir: Path,
+) -> Path:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    base = out_dir / f"{update_id if update_id is not None else int(time.time() * 1000)}"
+    with open(base.with_suffix(".collapsed"), "w", encoding="utf-8") as f:
+        for stack, count in samples.most_common():
+            f.write(f"{stack} {count}\n")
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    snapshot.dump(str(base.with_suffix(".tracemalloc")))
+    with open(base.with_suffix(".alloc.txt"), "w", encoding="utf-8") as f:
+        for stat in snapshot.statistics("traceback")[:ALLOC_TOP]:
+            f.write(f"{stat.size / 1024:.1f} KiB in {stat.count} blocks\n")
+            f.writelines(f"    {line}\n" for line in stat.traceback.format(most_recent_first=True))
+    return base
+
+
+def _save_profile(
+    update_id: Optional[int],
+    samples: Counter[str],
+    snapshot: tracemalloc.Snapshot,
+    out_dir: Path,
+    elapsed_ms: float,
+) -> None:
+    try:
+        base = _write_profile(update_id, samples, snapshot, out_dir)
+        logger.info(
+            "Профиль апдейта %s: %.0f мс, %d сэмплов → %s.*",
+            update_id, elapsed_ms, sum(samples.values()), base,
+        )
+    except OSError as e:
+        logger.warning("Не удалось записать профиль апдейта %s: %s", update_id, e)
+
+
+def flush(timeout: Optional[float] = None) -> None:
+    """Дожидается записи уже снятых профилей (тесты, остановка)."""
+    _writer.submit(lambda: None).result(timeout)
+
+
+async def to_thread(func: Callable[..., T], *args, **kwargs) -> T:
+    """
+    asyncio.to_thread, при котором поток попадает в профиль текущего апдейта
+    (если апдейт профилируется). Без профилирования — обычный asyncio.to_thread.
+    """
+    sampler = _current_sampler.get()
+    if sampler is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+
+    @functools.wraps(func)
+    def tracked() -> T:
+        ident = threading.get_ident()
+        sampler.track(ident)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sampler.untrack(ident)
+
+    return await asyncio.to_thread(tracked)
+
+
+@contextmanager
+def profile_request(
+    update_id: Optional[int],
+    force: bool = False,
+    out_dir: Path = PROFILE_DIR,
+) -> Iterator[bool]:
+    """
+    Профилирует блок, если апдейт попал в выборку (или force=True) и другой апдейт
+    сейчас не профилируется. Отдаёт True, если профилирование включено для этого блока.
+    Вызывается в потоке event loop: его стеки и потоки to_thread из блока попадают в профиль.
+    """
+    if not force and (_sample_rate <= 0 or random.random() >= _sample_rate):
+        yield False
+        return
+    if not _active.acquire(blocking=False):
+        yield False
+        return
+    # tracemalloc мог быть включён снаружи (бенчмарк) — тогда не выключаем его после
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    sampler = StackSampler(PROFILE_INTERVAL_MS / 1000, threads=(threading.get_ident(),))
+    token = _current_sampler.set(sampler)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        yield True
+    finally:
+        _current_sampler.reset(token)
+        samples = sampler.stop()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        # Снимок — здесь, пока tracemalloc включён; обработка снимка и запись — в фоне
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+        _active.release()
+        inc("profiled_requests_total", help_text="Апдейты, обработанные под профилировщиком")
+        _writer.submit(_save_profile, update_id, samples, snapshot, out_dir, elapsed_ms)
@@ -1,30 +1,67 @@
 """
-RAG: загрузка Markdown из data/*.md, разбиение RecursiveCharacterTextSplitter,
+RAG: загрузка Markdown из data/*.md, разбиение по секциям заголовков (chunking.py),
 эмбеддинги в Qdrant, поиск по релевантности.
 """
 import logging
-from typing import Optional
+from itertools import islice
+from typing import Iterator, Optional
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, PointStruct, VectorParams
+import numpy as np
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    Distance,
+    FieldCondition,
+    Filter,
+    MatchValue,
+    PayloadSchemaType,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+    VectorParams,
+)
 
 from .config import (
     DATA_DIR,
     RAG_TOP_K,
     EMBEDDING_MODEL,
     EMBEDDING_DIM,
+    EMBEDDING_MODEL_DIM,
     QDRANT_HOST,
     QDRANT_PORT,
+    QDRANT_GRPC_PORT,
+    QDRANT_PREFER_GRPC,
+    QDRANT_ASYNC,
+    QDRANT_TIMEOUT,
+    QDRANT_POOL_SIZE,
+    QDRANT_LOCATION,
     QDRANT_COLLECTION,
-    CHUNK_SIZE,
-    CHUNK_OVERLAP,
+    QDRANT_QUANTIZATION,
+    QDRANT_OVERSAMPLING,
+    UPSERT_BATCH_SIZE,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_BATCH_WAIT_MS,
 )
+from .batching import EmbeddingBatcher
+from .chunking import iter_chunks
+from .metrics import count_usage, span
+from .profiling import to_thread
 
 logger = logging.getLogger(__name__)
 
 _openai_client = None
 _qdrant_client: Optional[QdrantClient] = None
+_async_qdrant_client: Optional[AsyncQdrantClient] = None
+
+# Keepalive для долгоживущих gRPC-каналов: соединение не рвётся между редкими вопросами
+GRPC_OPTIONS = {
+    "grpc.keepalive_time_ms": 30_000,
+    "grpc.keepalive_timeout_ms": 10_000,
+    "grpc.keepalive_permit_without_calls": 1,
+}
 
 
 def _get_openai_client():
@@ -39,82 +76,188 @@ def _get_openai_client():
     return _openai_client
 
 
+def qdrant_client_kwargs(prefer_grpc: bool = QDRANT_PREFER_GRPC) -> dict:
+    """
+    Параметры подключения к Qdrant: REST (QDRANT_PORT) или gRPC (QDRANT_GRPC_PORT),
+    таймаут и размер пула соединений из конфига; при QDRANT_LOCATION — встроенный Qdrant.
+    """
+    if QDRANT_LOCATION == ":memory:":
+        return {"location": QDRANT_LOCATION}
+    if QDRANT_LOCATION:
+        return {"path": QDRANT_LOCATION}
+    kwargs = {
+        "host": QDRANT_HOST,
+        "port": QDRANT_PORT,
+        "grpc_port": QDRANT_GRPC_PORT,
+        "prefer_grpc": prefer_grpc,
+        "timeout": QDRANT_TIMEOUT,
+    }
+    if prefer_grpc:
+        kwargs["grpc_options"] = GRPC_OPTIONS
+    if QDRANT_POOL_SIZE:
+        kwargs["pool_size"] = QDRANT_POOL_SIZE
+    return kwargs
+
+
 def get_qdrant_client() -> QdrantClient:
-    """Клиент Qdrant (host:port или url)."""
+    """Клиент Qdrant (REST или gRPC — по QDRANT_PREFER_GRPC)."""
     global _qdrant_client
     if _qdrant_client is None:
-        _qdrant_client = QdrantClient(host=QDRANT_HOST, port=QDRANT_PORT)
+        _qdrant_client = QdrantClient(**qdrant_client_kwargs())
     return _qdrant_client
 
 
-def _load_md_sources() -> list[tuple[str, str]]:
+def get_async_qdrant_client() -> AsyncQdrantClient:
+    """Асинхронный клиент Qdrant для aretrieve (QDRANT_ASYNC); создаётся в event loop бота."""
+    global _async_qdrant_client
+    if _async_qdrant_client is None:
+        _async_qdrant_client = AsyncQdrantClient(**qdrant_client_kwargs())
+    return _async_qdrant_client
+
+
+def warm_up() -> None:
     """
-    Загружает все .md файлы из data/.
-    Возвращает список (content, source_id), где source_id — имя файла без расширения.
+    Открывает соединения с OpenAI и Qdrant заранее (TCP/TLS в пуле клиента),
+    чтобы первый вопрос не платил за установку соединений.
     """
-    sources = []
-    if not DATA_DIR.exists():
-        return sources
-    for path in sorted(DATA_DIR.glob("*.md")):
-        try:
-            content = path.read_text(encoding="utf-8")
-            source_id = path.stem
-            if content.strip():
-                sources.append((content.strip(), source_id))
-        except Exception as e:
-            logger.warning("Не удалось прочитать %s: %s", path, e)
-    return sources
+    _get_openai_client().with_options(max_retries=0, timeout=10).models.retrieve(EMBEDDING_MODEL)
+    get_qdrant_client().get_collections()
 
 
-def build_chunks() -> list[dict]:
+def build_chunks() -> Iterator[dict]:
     """
-    Строит чанки из Markdown-файлов в data/*.md с помощью RecursiveCharacterTextSplitter.
-    Каждый чанк: {"text": str, "source": str (program id из имени файла)}.
+    Потоковые чанки из Markdown-файлов в data/*.md (по секциям заголовков, см. chunking.py).
+    Каждый чанк: {"text": str, "source": str (program id из имени файла), "headings": list[str]}.
+    Неизменённые файлы берутся из кэша чанков.
     """
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-        separators=["\n\n", "\n", ". ", " ", ""],
-    )
-    sources = _load_md_sources()
-    if not sources:
+    if not any(DATA_DIR.glob("*.md")):
         logger.warning("Нет .md файлов в %s. Запустите scraper.", DATA_DIR)
-        return []
-    chunks = []
-    for content, source_id in sources:
-        for piece in splitter.split_text(content):
-            piece = piece.strip()
-            if piece:
-                chunks.append({"text": piece, "source": source_id})
-    logger.info("Построено %d чанков из %d источников", len(chunks), len(sources))
-    return chunks
+        return
+    yield from iter_chunks(DATA_DIR)
+
+
+def _embedding_input(chunk: dict) -> str:
+    """Текст для эмбеддинга: путь заголовков секции + текст чанка."""
+    headings = " > ".join(chunk.get("headings") or [])
+    return f"{headings}\n{chunk['text']}" if headings else chunk["text"]
+
+
+def get_embeddings(texts: list[str]) -> list[list[float]]:
+    """Эмбеддинги нескольких текстов одним запросом к OpenAI API (в исходном порядке)."""
+    client = _get_openai_client()
+    # Уменьшенная размерность запрашивается у API, а не обрезается локально
+    kwargs = {"dimensions": EMBEDDING_DIM} if EMBEDDING_DIM != EMBEDDING_MODEL_DIM else {}
+    with span("embedding_request"):
+        r = client.embeddings.create(
+            model=EMBEDDING_MODEL, input=[t.strip()[:8000] for t in texts], **kwargs
+        )
+    count_usage("embedding", r)
+    return [d.embedding for d in sorted(r.data, key=lambda d: d.index)]
 
 
 def get_embedding(text: str) -> list[float]:
     """Получить эмбеддинг текста через OpenAI API."""
-    client = _get_openai_client()
-    r = client.embeddings.create(model=EMBEDDING_MODEL, input=text.strip()[:8000])
-    return r.data[0].embedding
+    with span("embedding"):
+        return get_embeddings([text])[0]
+
+
+# Вопросы одновременных пользователей объединяются в один запрос к embeddings API
+_query_batcher = EmbeddingBatcher(get_embeddings, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_WAIT_MS)
+
 
+async def aget_embedding(text: str) -> list[float]:
+    """Эмбеддинг вопроса через микробатчер (ожидание в очереди входит в этап embedding)."""
+    with span("embedding"):
+        return await _query_batcher.embed(text)
+
+
+def quantization_config(mode: str = QDRANT_QUANTIZATION):
+    """
+    Конфигурация квантования Qdrant для режима "int8" / "binary"; None — без квантования.
+    ValueError — неизвестный режим (QDRANT_QUANTIZATION проверяется в config).
+    """
+    if mode == "int8":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if mode == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    if mode:
+        raise ValueError(f"Неизвестный режим квантования {mode!r}, допустимы: int8, binary")
+    return None
+
+
+def search_params(mode: str = QDRANT_QUANTIZATION) -> Optional[SearchParams]:
+    """Поиск по квантованному индексу с oversampling и пересчётом по исходным векторам."""
+    if quantization_config(mode) is None:
+        return None
+    return SearchParams(
+        quantization=QuantizationSearchParams(rescore=True, oversampling=QDRANT_OVERSAMPLING)
+    )
 
-def ensure_collection() -> None:
-    """Создаёт коллекцию в Qdrant, если её ещё нет."""
+
+def ensure_collection(
+    collection_name: str = QDRANT_COLLECTION,
+    dim: int = EMBEDDING_DIM,
+    quantization: str = QDRANT_QUANTIZATION,
+) -> None:
+    """
+    Создаёт коллекцию в Qdrant, если её ещё нет.
+    При квантовании исходные векторы хранятся на диске (нужны только для rescoring).
+    Настройки существующей коллекции не меняются — для смены режима пересоберите индекс (force=True).
+    """
     client = get_qdrant_client()
     collections = client.get_collections().collections
-    if any(c.name == QDRANT_COLLECTION for c in collections):
+    if any(c.name == collection_name for c in collections):
         return
+    quant = quantization_config(quantization)
     client.create_collection(
+        collection_name=collection_name,
+        vectors_config=VectorParams(size=dim, distance=Distance.COSINE, on_disk=quant is not None),
+        quantization_config=quant,
+    )
+    logger.info(
+        "Коллекция Qdrant создана: %s (dim=%d, квантование: %s)",
+        collection_name, dim, quantization or "нет",
+    )
+
+
+def ensure_source_index() -> None:
+    """Создаёт payload-индекс по полю source (id программы) для фильтрованного поиска."""
+    client = get_qdrant_client()
+    try:
+        client.create_payload_index(
+            collection_name=QDRANT_COLLECTION,
+            field_name="source",
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+    except Exception as e:
+        logger.warning("Не удалось создать индекс по source: %s", e)
+
+
+def upload_chunks(client: QdrantClient, chunks: list[dict], vectors, start_id: int = 0, **extra_payload) -> None:
+    """
+    Загружает чанки с готовыми векторами (массив n × dim) в коллекцию, id — start_id, start_id + 1, ...
+    Векторы передаются массивом float32: по gRPC они уходят в protobuf без JSON-кодирования.
+    """
+    client.upload_collection(
         collection_name=QDRANT_COLLECTION,
-        vectors_config=VectorParams(size=EMBEDDING_DIM, distance=Distance.COSINE),
+        vectors=np.asarray(vectors, dtype=np.float32),
+        payload=[
+            {"text": c["text"], "source": c["source"], "headings": c.get("headings", []), **extra_payload}
+            for c in chunks
+        ],
+        ids=range(start_id, start_id + len(chunks)),
+        batch_size=UPSERT_BATCH_SIZE,
+        wait=True,
     )
-    logger.info("Коллекция Qdrant создана: %s", QDRANT_COLLECTION)
 
 
-def build_index(force: bool = False) -> int:
+def build_index(force: bool = False, **extra_payload) -> int:
     """
     Строит индекс: чанки + эмбеддинги, сохраняет в Qdrant.
     Если force=True — пересоздаёт коллекцию и заново загружает точки.
+    extra_payload добавляется в payload каждой точки (например, sources_id).
     Возвращает количество проиндексированных чанков.
     """
     client = get_qdrant_client()
@@ -124,28 +267,25 @@ def build_index(force: bool = False) -> int:
         except Exception:
             pass
     ensure_collection()
+    ensure_source_index()
+    total = 0
+    sources = set()
     chunks = build_chunks()
-    if not chunks:
-        logger.warning("Нет чанков для индексации")
-        return 0
-    points = []
-    for i, c in enumerate(chunks):
+    # Пачка чанков — один запрос эмбеддингов и одна загрузка; весь корпус в памяти не держим
+    while batch := list(islice(chunks, UPSERT_BATCH_SIZE)):
+        sources.update(c["source"] for c in batch)
         try:
-            emb = get_embedding(c["text"])
-            points.append(
-                PointStruct(
-                    id=i,
-                    vector=emb,
-                    payload={"text": c["text"], "source": c["source"]},
-                )
-            )
+            vectors = get_embeddings([_embedding_input(c) for c in batch])
         except Exception as e:
-            logger.warning("Ошибка эмбеддинга чанка %s: %s", i, e)
-    if not points:
+            logger.warning("Ошибка эмбеддинга чанков %d–%d: %s", total, total + len(batch) - 1, e)
+            continue
+        upload_chunks(client, batch, vectors, start_id=total, **extra_payload)
+        total += len(batch)
+    if not total:
+        logger.warning("Нет чанков для индексации")
         return 0
-    client.upsert(collection_name=QDRANT_COLLECTION, points=points)
-    logger.info("Индекс в Qdrant обновлён: %d чанков", len(points))
-    return len(points)
+    logger.info("Индекс в Qdrant обновлён: %d чанков из %d источников", total, len(sources))
+    return total
 
 
 def has_index() -> bool:
@@ -159,49 +299,138 @@ def has_index() -> bool:
         return False
 
 
-def retrieve(
-    query: str,
-    top_k: int = RAG_TOP_K,
-) -> str:
-    """
-    Поиск по запросу: эмбеддинг query, поиск в Qdrant, возврат конкатенации top_k чанков.
-    """
+def _source_filter(program_id: Optional[str]) -> Optional[Filter]:
+    """Фильтр Qdrant по полю source; None — поиск по всей коллекции."""
+    if not program_id:
+        return None
+    return Filter(must=[FieldCondition(key="source", match=MatchValue(value=program_id))])
+
+
+def _collection_ready(client: QdrantClient) -> bool:
+    """Коллекция существует и не пуста (ошибки логируются и считаются в метриках)."""
     try:
-        client = get_qdrant_client()
-        if client.get_collection(QDRANT_COLLECTION).points_count == 0:
-            return ""
+        with span("qdrant_collection"):
+            return client.get_collection(QDRANT_COLLECTION).points_count > 0
     except Exception as e:
         logger.warning("Qdrant retrieve: %s", e)
-        return ""
+        return False
+
+
+async def _acollection_ready(client: AsyncQdrantClient) -> bool:
+    """_collection_ready для асинхронного клиента."""
     try:
-        q_emb = get_embedding(query)
+        with span("qdrant_collection"):
+            return (await client.get_collection(QDRANT_COLLECTION)).points_count > 0
     except Exception as e:
-        logger.warning("Ошибка эмбеддинга запроса: %s", e)
-        return ""
+        logger.warning("Qdrant retrieve: %s", e)
+        return False
+
+
+def _join_hits(points) -> str:
+    """Конкатенация текстов найденных чанков с путём заголовков."""
+    texts = []
+    for hit in points:
+        payload = getattr(hit, "payload", None) or {}
+        if isinstance(payload, dict):
+            t = payload.get("text", "")
+            headings = payload.get("headings") or []
+            if t and headings:
+                t = f"[{' > '.join(headings)}]\n{t}"
+            if t:
+                texts.append(t)
+    return "\n\n---\n\n".join(texts)
+
+
+def _search(
+    client: QdrantClient,
+    q_emb: list[float],
+    top_k: int,
+    program_id: Optional[str],
+) -> str:
+    """Поиск в Qdrant по готовому эмбеддингу, конкатенация текстов найденных чанков."""
+    query_filter = _source_filter(program_id)
     try:
-        # qdrant-client 2.x: метод search заменён на query_points
-        if hasattr(client, "query_points"):
+        with span("qdrant_search"):
             response = client.query_points(
                 collection_name=QDRANT_COLLECTION,
                 query=q_emb,
+                query_filter=query_filter,
+                search_params=search_params(),
                 limit=top_k,
             )
-            points = getattr(response, "points", None) or getattr(response, "result", None) or []
-        else:
-            # старый API: client.search
-            points = client.search(
+        return _join_hits(response.points)
+    except Exception as e:
+        logger.warning("Ошибка поиска Qdrant: %s", e)
+        return ""
+
+
+async def _asearch(
+    client: AsyncQdrantClient,
+    q_emb: list[float],
+    top_k: int,
+    program_id: Optional[str],
+) -> str:
+    """_search для асинхронного клиента (query_points)."""
+    try:
+        with span("qdrant_search"):
+            response = await client.query_points(
                 collection_name=QDRANT_COLLECTION,
-                query_vector=q_emb,
+                query=q_emb,
+                query_filter=_source_filter(program_id),
+                search_params=search_params(),
                 limit=top_k,
             )
-        texts = []
-        for hit in points:
-            payload = getattr(hit, "payload", None) or {}
-            if isinstance(payload, dict):
-                t = payload.get("text", "")
-                if t:
-                    texts.append(t)
-        return "\n\n---\n\n".join(texts)
+        return _join_hits(response.points)
     except Exception as e:
         logger.warning("Ошибка поиска Qdrant: %s", e)
         return ""
+
+
+def retrieve(
+    query: str,
+    top_k: int = RAG_TOP_K,
+    program_id: Optional[str] = None,
+) -> str:
+    """
+    Поиск по запросу: эмбеддинг query, поиск в Qdrant, возврат конкатенации top_k чанков.
+    program_id ('ai' / 'ai_product') ограничивает поиск чанками одной программы.
+    """
+    client = get_qdrant_client()
+    if not _collection_ready(client):
+        return ""
+    try:
+        q_emb = get_embedding(query)
+    except Exception as e:
+        logger.warning("Ошибка эмбеддинга запроса: %s", e)
+        return ""
+    return _search(client, q_emb, top_k, program_id)
+
+
+async def aretrieve(
+    query: str,
+    top_k: int = RAG_TOP_K,
+    program_id: Optional[str] = None,
+) -> str:
+    """
+    Асинхронный retrieve для бота: эмбеддинг через микробатчер, вызовы Qdrant — через
+    AsyncQdrantClient (QDRANT_ASYNC) или синхронный клиент в потоке,
+    чтобы event loop обслуживал других пользователей.
+    """
+    # Встроенный Qdrant — одно хранилище на процесс, поэтому только синхронный клиент
+    use_async = QDRANT_ASYNC and not QDRANT_LOCATION
+    if use_async:
+        aclient = get_async_qdrant_client()
+        if not await _acollection_ready(aclient):
+            return ""
+    else:
+        client = get_qdrant_client()
+        if not await to_thread(_collection_ready, client):
+            return ""
+    try:
+        q_emb = await aget_embedding(query)
+    except Exception as e:
+        logger.warning("Ошибка эмбеддинга запроса: %s", e)
+        return ""
+    if use_async:
+        return await _asearch(aclient, q_emb, top_k, program_id)
+    return await to_thread(_search, client, q_emb, top_k, program_id)
@@ -1,28 +1,73 @@
 """
 Парсинг страниц магистратур ИТМО: загрузка HTML, конвертация в Markdown через html2text, сохранение в data/*.md.
+
+Страницы загружаются параллельно через общую HTTP-сессию с условными запросами
+(ETag / If-Modified-Since). В data/scrape_manifest.json хранятся валидаторы и хэш
+содержимого: неизменённая страница стоит один ответ 304 и не перезаписывает файл.
 """
+import hashlib
+import importlib.util
+import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import html2text
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
-from .config import DATA_DIR, URL_AI, URL_AI_PRODUCT
+from .config import DATA_DIR, PROGRAM_URLS
 
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36"
 }
 
+MANIFEST_NAME = "scrape_manifest.json"
 
-def fetch_page(url: str) -> str | None:
-    """Загружает HTML страницы."""
-    try:
-        r = requests.get(url, headers=HEADERS, timeout=15)
-        r.raise_for_status()
-        return r.text
-    except Exception as e:
-        print(f"Ошибка загрузки {url}: {e}")
-        return None
+# lxml на порядок быстрее встроенного html.parser; без него — встроенный парсер
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+# Статусы страницы после run_scraper
+CHANGED = "changed"
+UNCHANGED = "unchanged"
+NOT_MODIFIED = "not_modified"
+FAILED = "failed"
+
+
+def make_session(pool_size: int = 4) -> requests.Session:
+    """HTTP-сессия с пулом keep-alive соединений и общими заголовками."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(HEADERS)
+    return session
+
+
+def fetch_page_conditional(
+    url: str,
+    session: requests.Session,
+    etag: str | None = None,
+    last_modified: str | None = None,
+) -> tuple[int, str | None, dict]:
+    """
+    Условный GET: отправляет If-None-Match / If-Modified-Since из прошлой загрузки.
+    Возвращает (status, html или None, {"etag", "last_modified"}); status 304 — страница не менялась.
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    r = session.get(url, headers=headers, timeout=15)
+    validators = {
+        "etag": r.headers.get("ETag") or etag,
+        "last_modified": r.headers.get("Last-Modified") or last_modified,
+    }
+    if r.status_code == 304:
+        return 304, None, validators
+    r.raise_for_status()
+    return r.status_code, r.text, validators
 
 
 def html_to_markdown(html: str) -> str:
@@ -30,7 +75,7 @@ def html_to_markdown(html: str) -> str:
     Конвертирует HTML в Markdown с помощью html2text.
     Сохраняет структуру заголовков, списков и ссылок.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, HTML_PARSER)
     for tag in soup(["script", "style", "nav", "header", "footer"]):
         tag.decompose()
     body = soup.find("body") or soup
@@ -43,28 +88,96 @@ def html_to_markdown(html: str) -> str:
     return h.handle(html_clean)
 
 
-def scrape_and_save_md(url: str, program_id: str) -> Path | None:
+def content_hash(text: str) -> str:
+    """SHA-256 текста (для манифеста и ключей кэша)."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_manifest(data_dir: Path = DATA_DIR) -> dict:
+    """Читает манифест парсера: program_id -> {url, etag, last_modified, sha256}."""
+    path = data_dir / MANIFEST_NAME
+    if not path.exists():
+        return {}
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError) as e:
+        print(f"Манифест {path} повреждён, загружаем всё заново: {e}")
+        return {}
+
+
+def save_manifest(manifest: dict, data_dir: Path = DATA_DIR) -> None:
+    data_dir.mkdir(parents=True, exist_ok=True)
+    path = data_dir / MANIFEST_NAME
+    path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+
+
+def scrape_and_save_md(
+    url: str,
+    program_id: str,
+    session: requests.Session | None = None,
+    entry: dict | None = None,
+    data_dir: Path = DATA_DIR,
+) -> tuple[str, dict]:
     """
-    Загружает страницу, конвертирует в Markdown, сохраняет в data/{program_id}.md.
-    Возвращает путь к файлу или None при ошибке.
+    Загружает страницу (условно, по валидаторам из entry), конвертирует в Markdown и
+    сохраняет в data/{program_id}.md только если содержимое изменилось.
+    Возвращает (статус, новая запись манифеста).
     """
-    html = fetch_page(url)
-    if not html:
-        return None
+    session = session or make_session(1)
+    entry = dict(entry or {})
+    path = data_dir / f"{program_id}.md"
+    # Без файла на диске валидаторы бесполезны — нужна полная загрузка
+    if not path.exists() or entry.get("url") != url:
+        entry = {}
+    try:
+        status, html, validators = fetch_page_conditional(
+            url, session, entry.get("etag"), entry.get("last_modified")
+        )
+    except Exception as e:
+        print(f"Ошибка загрузки {url}: {e}")
+        return FAILED, entry
+    entry.update(url=url, **validators)
+    if status == 304:
+        print(f"Не изменилось (304): {url}")
+        return NOT_MODIFIED, entry
     md = html_to_markdown(html)
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    path = DATA_DIR / f"{program_id}.md"
+    digest = content_hash(md)
+    if entry.get("sha256") == digest:
+        print(f"Содержимое не изменилось: {path}")
+        return UNCHANGED, entry
+    data_dir.mkdir(parents=True, exist_ok=True)
     path.write_text(md, encoding="utf-8")
+    entry["sha256"] = digest
     print(f"Сохранено: {path}")
-    return path
-
-
-def run_scraper() -> None:
-    """Запуск парсера: загрузка обеих программ, сохранение в data/*.md."""
-    programs = [
-        (URL_AI, "ai"),
-        (URL_AI_PRODUCT, "ai_product"),
-    ]
-    for url, program_id in programs:
-        scrape_and_save_md(url, program_id)
-    print("Парсинг завершён. Файлы: data/ai.md, data/ai_product.md")
+    return CHANGED, entry
+
+
+def run_scraper(
+    programs: dict[str, str] | None = None,
+    data_dir: Path = DATA_DIR,
+    max_workers: int = 4,
+) -> dict[str, str]:
+    """
+    Запуск парсера: параллельная загрузка программ из реестра (program_id -> URL),
+    сохранение изменившихся страниц в data/*.md и обновление манифеста.
+    Возвращает статус по каждой программе (changed / unchanged / not_modified / failed).
+    """
+    programs = programs if programs is not None else PROGRAM_URLS
+    manifest = load_manifest(data_dir)
+    workers = max(1, min(max_workers, len(programs)))
+    with make_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            program_id: pool.submit(
+                scrape_and_save_md, url, program_id, session, manifest.get(program_id), data_dir
+            )
+            for program_id, url in programs.items()
+        }
+        statuses = {}
+        for program_id, future in futures.items():
+            statuses[program_id], entry = future.result()
+            if entry:
+                manifest[program_id] = entry
+    save_manifest(manifest, data_dir)
+    changed = [pid for pid, s in statuses.items() if s == CHANGED]
+    print(f"Парсинг завершён. Изменились: {', '.join(changed) or 'нет'}")
+    return statuses
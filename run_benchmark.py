@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Точка входа: офлайн-бенчмарк handle_message на подменных OpenAI, Qdrant и Telegram."""
+import argparse
+import asyncio
+import json
+import os
+
+
+def _latency(value: str) -> tuple[float, float]:
+    """Формат: base_ms или base_ms:jitter_ms."""
+    base, _, jitter = value.partition(":")
+    return float(base), float(jitter or 0)
+
+
+def _ints(value: str) -> tuple[int, ...]:
+    return tuple(int(x) for x in value.split(","))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--replay", help="JSONL со сценариями (по умолчанию bench/replay.jsonl)")
+    parser.add_argument("--scenario", action="append", help="запустить только указанные сценарии")
+    parser.add_argument("--iterations", type=int, default=20, help="повторов сценария (параллельных диалогов)")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременно обрабатываемых апдейтов")
+    parser.add_argument("--chat-latency", type=_latency, default="300:100", help="задержка chat completions, мс")
+    parser.add_argument("--embedding-latency", type=_latency, default="50:20", help="задержка embeddings, мс")
+    parser.add_argument("--telegram-latency", type=_latency, default="30:10", help="задержка отправки в Telegram, мс")
+    parser.add_argument(
+        "--debounce-ms", type=float, help="окно склейки сообщений пользователя, мс (по умолчанию DEBOUNCE_WINDOW_MS)"
+    )
+    parser.add_argument("--no-memory", action="store_true", help="не замерять память (tracemalloc замедляет прогон)")
+    parser.add_argument("--output", help="сохранить отчёт в JSON (для сравнения между коммитами)")
+    parser.add_argument("--chunking", action="store_true", help="бенчмарк чанкинга вместо handle_message")
+    parser.add_argument("--scale", type=int, default=100, help="во сколько раз размножить data/*.md для --chunking")
+    parser.add_argument(
+        "--quantization", action="store_true",
+        help="recall@k и задержка float32 vs int8/binary на запущенном Qdrant (реальные эмбеддинги OpenAI)",
+    )
+    parser.add_argument("--dims", type=_ints, default=(1536,), help="размерности для --quantization, через запятую")
+    parser.add_argument("--top-k", type=int, default=5, help="k для recall@k в --quantization и поиска в --transport")
+    parser.add_argument("--fake-embeddings", action="store_true", help="--quantization без OpenAI (псевдо-эмбеддинги)")
+    parser.add_argument(
+        "--transport", action="store_true",
+        help="REST vs gRPC: скорость загрузки и задержка поиска на запущенном Qdrant (случайные векторы)",
+    )
+    parser.add_argument("--points", type=int, default=5000, help="число точек для --transport")
+    args = parser.parse_args()
+
+    # Для сценариев handle_message ключ нужен только чтобы бот включил ветку RAG — запросы идут в фейковый клиент.
+    # Бенчмарк квантования использует настоящий OPENAI_API_KEY из окружения/.env.
+    if not args.quantization or args.fake_embeddings:
+        os.environ["OPENAI_API_KEY"] = os.getenv("BENCH_OPENAI_API_KEY", "bench-fake-key")
+
+    from aith_chatbot import benchmark
+
+    if args.chunking:
+        report = benchmark.run_chunking_benchmark(args.scale)
+        print(benchmark.format_chunking_report(report))
+    elif args.transport:
+        report = benchmark.run_transport_benchmark(points=args.points, top_k=args.top_k)
+        print(benchmark.format_transport_report(report))
+    elif args.quantization:
+        report = benchmark.run_quantization_benchmark(
+            benchmark.default_queries(args.replay or benchmark.REPLAY_FILE),
+            dims=args.dims,
+            top_k=args.top_k,
+            fake_embeddings=args.fake_embeddings,
+        )
+        print(benchmark.format_quantization_report(report))
+    else:
+        report = asyncio.run(
+            benchmark.run_benchmark(
+                replay_path=args.replay or benchmark.REPLAY_FILE,
+                scenarios=args.scenario,
+                iterations=args.iterations,
+                concurrency=args.concurrency,
+                chat_latency=benchmark.FakeLatency(*args.chat_latency),
+                embedding_latency=benchmark.FakeLatency(*args.embedding_latency),
+                telegram_latency=benchmark.FakeLatency(*args.telegram_latency),
+                measure_memory=not args.no_memory,
+                debounce_ms=args.debounce_ms,
+            )
+        )
+        print(benchmark.format_report(report))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчёт сохранён: {args.output}")
@@ -1,16 +1,34 @@
 #!/usr/bin/env python3
-"""Точка входа: сборка индекса RAG в Qdrant."""
+"""
+Точка входа: сборка бандла индекса RAG (data/index_bundle: чанки, векторы, манифест)
+и его загрузка в Qdrant.
+"""
+import argparse
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
-if not os.getenv("OPENAI_API_KEY"):
-    print("Укажите OPENAI_API_KEY в .env")
-    exit(1)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--bundle-only", action="store_true", help="только собрать бандл, Qdrant не нужен")
+    parser.add_argument("--from-bundle", action="store_true", help="загрузить готовый бандл в Qdrant без эмбеддингов")
+    args = parser.parse_args()
 
-from aith_chatbot.rag import build_index
+    if not args.from_bundle and not os.getenv("OPENAI_API_KEY"):
+        print("Укажите OPENAI_API_KEY в .env")
+        exit(1)
 
-if __name__ == "__main__":
-    n = build_index(force=True)
-    print(f"Индекс RAG собран в Qdrant: {n} чанков")
+    from aith_chatbot.config import INDEX_BUNDLE_DIR
+    from aith_chatbot.index_bundle import StaleBundleError, export_bundle, restore_bundle
+
+    if not args.from_bundle:
+        manifest = export_bundle()
+        print(f"Бандл индекса {manifest['bundle_id']} собран: {manifest['count']} чанков → {INDEX_BUNDLE_DIR}")
+    if not args.bundle_only:
+        try:
+            n = restore_bundle(force=True)
+        except StaleBundleError as e:
+            print(e)
+            exit(1)
+        print(f"Индекс RAG загружен в Qdrant: {n} чанков")
@@ -0,0 +1,23 @@
+import pytest
+from qdrant_client import QdrantClient
+
+from aith_chatbot import rag
+from aith_chatbot.benchmark import FakeLatency, FakeOpenAI
+
+
+@pytest.fixture
+def fake_openai(monkeypatch):
+    """Подменный OpenAI без сети: детерминированные эмбеддинги, счётчик вызовов."""
+    client = FakeOpenAI(FakeLatency(), FakeLatency())
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(rag, "_openai_client", client)
+    return client
+
+
+@pytest.fixture
+def qdrant(monkeypatch):
+    """Встроенный Qdrant в памяти вместо сервера."""
+    client = QdrantClient(location=":memory:")
+    monkeypatch.setattr(rag, "_qdrant_client", client)
+    yield client
+    client.close()
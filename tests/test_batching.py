@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+from aith_chatbot.batching import EmbeddingBatcher
+
+
+def _vector(text):
+    return [float(len(text))]
+
+
+def test_concurrent_requests_share_one_call():
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        return [_vector(t) for t in texts]
+
+    async def main():
+        batcher = EmbeddingBatcher(embed_many, max_batch=16, max_wait_ms=20)
+        return await asyncio.gather(*(batcher.embed(t) for t in ["a", "bb", "ccc"]))
+
+    assert asyncio.run(main()) == [[1.0], [2.0], [3.0]]
+    assert calls == [["a", "bb", "ccc"]]
+
+
+def test_duplicates_embedded_once():
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        return [_vector(t) for t in texts]
+
+    async def main():
+        batcher = EmbeddingBatcher(embed_many, max_batch=16, max_wait_ms=20)
+        return await asyncio.gather(batcher.embed("вопрос"), batcher.embed("вопрос"))
+
+    assert asyncio.run(main()) == [[6.0], [6.0]]
+    assert calls == [["вопрос"]]
+
+
+def test_max_batch_splits_requests():
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        return [_vector(t) for t in texts]
+
+    async def main():
+        batcher = EmbeddingBatcher(embed_many, max_batch=2, max_wait_ms=20)
+        return await asyncio.gather(*(batcher.embed(t) for t in ["a", "b", "c"]))
+
+    assert asyncio.run(main()) == [[1.0]] * 3
+    assert sorted(map(len, calls)) == [1, 2]
+
+
+def test_error_propagates_to_every_waiter():
+    def embed_many(texts):
+        raise RuntimeError("API недоступен")
+
+    async def main():
+        batcher = EmbeddingBatcher(embed_many, max_batch=16, max_wait_ms=5)
+        return await asyncio.gather(batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_batches_in_flight_do_not_block_next_batch():
+    release = threading.Event()
+
+    def embed_many(texts):
+        if texts == ["slow"]:
+            release.wait(5)
+        return [_vector(t) for t in texts]
+
+    async def main():
+        batcher = EmbeddingBatcher(embed_many, max_batch=1, max_wait_ms=0)
+        slow = asyncio.ensure_future(batcher.embed("slow"))
+        fast = await asyncio.wait_for(batcher.embed("fast"), 2)
+        assert not slow.done()
+        release.set()
+        return fast, await slow
+
+    assert asyncio.run(main()) == ([4.0], [4.0])
+
+
+def test_new_event_loop_gets_new_worker():
+    batcher = EmbeddingBatcher(lambda texts: [_vector(t) for t in texts], max_wait_ms=0)
+    assert asyncio.run(batcher.embed("a")) == [1.0]
+    assert asyncio.run(batcher.embed("ab")) == [2.0]
+
+
+def test_cancelled_waiters_not_embedded():
+    calls = []
+
+    def embed_many(texts):
+        calls.append(list(texts))
+        return [_vector(t) for t in texts]
+
+    async def main():
+        batcher = EmbeddingBatcher(embed_many, max_batch=16, max_wait_ms=30)
+        superseded = asyncio.ensure_future(batcher.embed("неполный вопрос"))
+        current = asyncio.ensure_future(batcher.embed("вопрос"))
+        await asyncio.sleep(0)
+        superseded.cancel()
+        return await current
+
+    assert asyncio.run(main()) == [6.0]
+    assert calls == [["вопрос"]]
@@ -0,0 +1,129 @@
+import json
+
+from aith_chatbot import metrics
+from aith_chatbot.chunking import chunk_file, chunk_markdown, iter_sections
+
+DOC = """# Искусственный интеллект
+
+Введение в программу.
+
+## Поступление
+
+Экзамен по программированию.
+
+### Сроки
+
+Приём документов до 1 августа.
+
+## Учебный план
+
+| Семестр | Дисциплина |
+|---------|------------|
+| 1 | Машинное обучение |
+| 2 | Глубокое обучение |
+
+```python
+# не заголовок
+print("код")
+```
+"""
+
+
+def _chunks(content, **kwargs):
+    return list(chunk_markdown(content, "ai", **kwargs))
+
+
+def test_sections_have_heading_paths():
+    sections = [(headings, heading) for headings, heading, _ in iter_sections(DOC)]
+    assert sections == [
+        (["Искусственный интеллект"], "# Искусственный интеллект"),
+        (["Искусственный интеллект", "Поступление"], "## Поступление"),
+        (["Искусственный интеллект", "Поступление", "Сроки"], "### Сроки"),
+        (["Искусственный интеллект", "Учебный план"], "## Учебный план"),
+    ]
+
+
+def test_chunks_do_not_cross_second_level_sections():
+    chunks = _chunks(DOC, chunk_size=1000, chunk_overlap=0)
+    assert [c["headings"] for c in chunks] == [
+        ["Искусственный интеллект"],
+        ["Искусственный интеллект", "Поступление"],
+        ["Искусственный интеллект", "Учебный план"],
+    ]
+    # Подсекция глубже границы остаётся в чанке вместе со строкой своего заголовка
+    assert "### Сроки\n\nПриём документов до 1 августа." in chunks[1]["text"]
+    assert all(c["source"] == "ai" for c in chunks)
+
+
+def test_table_and_code_kept_whole():
+    plan = _chunks(DOC, chunk_size=1000, chunk_overlap=0)[-1]["text"]
+    assert "| 1 | Машинное обучение |\n| 2 | Глубокое обучение |" in plan
+    assert '```python\n# не заголовок\nprint("код")\n```' in plan
+
+
+def test_chunk_size_respected_with_overlap():
+    content = "# Документ\n\n## Раздел\n\n" + "\n\n".join(f"Абзац номер {i} о программе." for i in range(40))
+    chunks = _chunks(content, chunk_size=200, chunk_overlap=60)
+    assert len(chunks) > 1
+    assert all(len(c["text"]) <= 200 for c in chunks)
+    for prev, nxt in zip(chunks, chunks[1:]):
+        # Следующий чанк начинается с последних абзацев предыдущего (не длиннее chunk_overlap)
+        prev_blocks, next_blocks = prev["text"].split("\n\n"), nxt["text"].split("\n\n")
+        shared = next(n for n in range(len(next_blocks), 0, -1) if prev_blocks[-n:] == next_blocks[:n])
+        assert sum(len(b) + 2 for b in next_blocks[:shared]) <= 60 + 2
+
+
+def test_oversized_table_split_with_header():
+    rows = "\n".join(f"| {i} | Дисциплина {i} |" for i in range(60))
+    content = f"## План\n\n| № | Название |\n|---|---|\n{rows}"
+    chunks = _chunks(content, chunk_size=300, chunk_overlap=0)
+    assert len(chunks) > 1
+    for c in chunks:
+        assert c["text"].startswith("## План") or c["text"].startswith("| № | Название |\n|---|---|")
+        assert len(c["text"]) <= 300
+
+
+def test_oversized_sentence_split():
+    content = "## Раздел\n\n" + "а" * 500
+    chunks = _chunks(content, chunk_size=200, chunk_overlap=0)
+    assert "".join(c["text"].replace("## Раздел", "").strip() for c in chunks) == "а" * 500
+    assert all(len(c["text"]) <= 200 for c in chunks)
+
+
+def test_text_before_first_heading():
+    chunks = _chunks("Вступление без заголовка.\n\n# Заголовок\n\nТекст.", chunk_size=1000, chunk_overlap=0)
+    assert chunks[0] == {"text": "Вступление без заголовка.", "source": "ai", "headings": []}
+
+
+def test_chunk_file_uses_cache(tmp_path):
+    path = tmp_path / "ai.md"
+    path.write_text(DOC, encoding="utf-8")
+    cache_dir = tmp_path / "cache"
+    first = list(chunk_file(path, cache_dir, chunk_size=1000, chunk_overlap=0))
+    cached = json.loads((cache_dir / "ai.json").read_text(encoding="utf-8"))
+    assert cached["chunks"] == first
+
+    # Подменённый кэш с тем же ключом читается вместо разбиения
+    cached["chunks"] = [{"text": "из кэша", "source": "ai", "headings": []}]
+    (cache_dir / "ai.json").write_text(json.dumps(cached), encoding="utf-8")
+    assert list(chunk_file(path, cache_dir, chunk_size=1000, chunk_overlap=0)) == cached["chunks"]
+
+    # Другие настройки — другой ключ, файл режется заново
+    assert list(chunk_file(path, cache_dir, chunk_size=500, chunk_overlap=0)) == first
+
+
+def test_chunk_cache_key_includes_section_depth(tmp_path):
+    metrics.reset()
+    path = tmp_path / "ai.md"
+    path.write_text(DOC, encoding="utf-8")
+    cache_dir = tmp_path / "cache"
+    by_h2 = list(chunk_file(path, cache_dir, chunk_size=1000, chunk_overlap=0, section_depth=2))
+    by_h1 = list(chunk_file(path, cache_dir, chunk_size=1000, chunk_overlap=0, section_depth=1))
+    assert by_h1 == list(chunk_markdown(DOC.strip(), "ai", 1000, 0, section_depth=1))
+    assert by_h1 != by_h2
+    assert list(chunk_file(path, cache_dir, chunk_size=1000, chunk_overlap=0, section_depth=1)) == by_h1
+
+    text = metrics.render_prometheus()
+    assert 'cache_misses_total{cache="chunks"} 2' in text
+    assert 'cache_hits_total{cache="chunks"} 1' in text
+    metrics.reset()
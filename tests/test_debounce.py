@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from aith_chatbot.debounce import QuestionDebouncer, Superseded
+
+
+async def _handle(debouncer, user_id, text, answers, delay=0.0):
+    """Как bot._handle_message: collect, затем ответ через run с commit перед «отправкой»."""
+    question = await debouncer.collect(user_id, text)
+    if question is None:
+        return
+
+    async def answer():
+        await asyncio.sleep(delay)
+        debouncer.commit(user_id)
+        answers.append(question)
+
+    await debouncer.run(user_id, answer())
+
+
+def test_fragments_within_window_merged():
+    debouncer = QuestionDebouncer(window_ms=50)
+    answers = []
+
+    async def main():
+        first = asyncio.ensure_future(_handle(debouncer, 1, "Здравствуйте!", answers))
+        await asyncio.sleep(0.01)
+        await asyncio.gather(first, _handle(debouncer, 1, "Какие экзамены?", answers))
+
+    asyncio.run(main())
+    assert answers == ["Здравствуйте!\nКакие экзамены?"]
+
+
+def test_pause_longer_than_window_gives_two_questions():
+    debouncer = QuestionDebouncer(window_ms=10)
+    answers = []
+
+    async def main():
+        await _handle(debouncer, 1, "первый", answers)
+        await _handle(debouncer, 1, "второй", answers)
+
+    asyncio.run(main())
+    assert answers == ["первый", "второй"]
+
+
+def test_users_not_merged():
+    debouncer = QuestionDebouncer(window_ms=20)
+    answers = []
+
+    async def main():
+        await asyncio.gather(_handle(debouncer, 1, "а", answers), _handle(debouncer, 2, "б", answers))
+
+    asyncio.run(main())
+    assert sorted(answers) == ["а", "б"]
+
+
+def test_fragment_during_answer_supersedes_it():
+    debouncer = QuestionDebouncer(window_ms=0)
+    answers = []
+
+    async def main():
+        first = asyncio.ensure_future(_handle(debouncer, 1, "Подскажите,", answers, delay=0.1))
+        await asyncio.sleep(0.02)
+        await _handle(debouncer, 1, "какие экзамены?", answers)
+        await first
+
+    asyncio.run(main())
+    assert answers == ["Подскажите,\nкакие экзамены?"]
+
+
+def test_committed_answer_not_cancelled():
+    debouncer = QuestionDebouncer(window_ms=0)
+    answers = []
+
+    async def answer():
+        debouncer.commit(1)
+        await asyncio.sleep(0.05)
+        answers.append("первый")
+
+    async def main():
+        await debouncer.collect(1, "первый")
+        first = asyncio.ensure_future(debouncer.run(1, answer()))
+        await asyncio.sleep(0.01)
+        await _handle(debouncer, 1, "второй", answers)
+        await first
+
+    asyncio.run(main())
+    assert answers == ["второй", "первый"]
+
+
+def test_is_current_tracks_generation():
+    debouncer = QuestionDebouncer(window_ms=0)
+
+    async def main():
+        await debouncer.collect(1, "а")
+        generation = debouncer.generation(1)
+        assert debouncer.is_current(1, generation)
+        await debouncer.collect(1, "б")
+        assert not debouncer.is_current(1, generation)
+        assert debouncer.is_current(1, debouncer.generation(1))
+        debouncer.commit(1)
+        assert debouncer.generation(1) is None
+
+    asyncio.run(main())
+
+
+def test_superseded_in_answer_is_swallowed():
+    debouncer = QuestionDebouncer(window_ms=0)
+
+    async def answer():
+        await debouncer.collect(1, "дополнение")
+        raise Superseded()
+
+    async def main():
+        await debouncer.collect(1, "вопрос")
+        await debouncer.run(1, answer())
+
+    asyncio.run(main())
+
+
+def test_handler_cancellation_propagates():
+    debouncer = QuestionDebouncer(window_ms=0)
+
+    async def main():
+        await debouncer.collect(1, "вопрос")
+        task = asyncio.ensure_future(debouncer.run(1, asyncio.sleep(1)))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
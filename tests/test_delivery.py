@@ -0,0 +1,188 @@
+import asyncio
+import time
+from datetime import timedelta
+
+import pytest
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.helpers import escape_markdown
+
+from aith_chatbot import metrics
+from aith_chatbot.delivery import DeliveryQueue, TokenBucket, split_message
+
+
+class FakeSend:
+    """reply_text: записывает отправленное; errors — исключения для первых попыток."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.sent = []
+        self.attempts = 0
+
+    async def __call__(self, text, **kwargs):
+        self.attempts += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append((text, kwargs))
+
+
+def _deliver(queue, chat_id, send, text, **kwargs):
+    async def main():
+        queue.submit(chat_id, send, text, **kwargs)
+        await queue.join(timeout=5)
+
+    asyncio.run(main())
+
+
+def _errors():
+    """Значения stage_errors_total по этапам из вывода /metrics."""
+    prefix = 'stage_errors_total{stage="'
+    return {
+        line[len(prefix):].split('"')[0]: float(line.rsplit(" ", 1)[1])
+        for line in metrics.render_prometheus().splitlines()
+        if line.startswith(prefix)
+    }
+
+
+def _queue(**kwargs):
+    return DeliveryQueue(**{"chat_rate": 0, "global_rate": 0, "retry_backoff": 0, **kwargs})
+
+
+# split_message
+
+
+def test_short_text_is_one_piece():
+    assert split_message("привет") == ["привет"]
+
+
+def test_split_prefers_paragraphs():
+    text = "а" * 60 + "\n\n" + "б" * 60
+    assert split_message(text, limit=100) == ["а" * 60, "б" * 60]
+
+
+def test_split_keeps_markup_balanced():
+    text = "слово " * 10 + "*жирный текст на несколько слов*" + " хвост" * 10
+    for piece in split_message(text, limit=64):
+        assert len(piece) <= 64
+        assert piece.count("*") % 2 == 0
+
+
+def test_split_reopens_code_block():
+    text = "```\n" + "\n".join(f"line {i}" for i in range(40)) + "\n```"
+    pieces = split_message(text, limit=100)
+    assert len(pieces) > 1
+    for piece in pieces:
+        assert len(piece) <= 100
+        assert piece.count("```") % 2 == 0
+
+
+def test_split_does_not_break_escape():
+    text = "x" * 94 + "\\_" + "y" * 50
+    pieces = split_message(text, limit=100)
+    assert "".join(pieces) == text
+    assert not pieces[0].endswith("\\")
+
+
+@pytest.mark.parametrize("count", [9000, 9001])
+def test_split_backslash_runs(count):
+    text = "\\" * count
+    pieces = split_message(text)
+    assert "".join(pieces) == text
+    assert all(len(p) <= 4096 for p in pieces)
+    # Без разделителей — жёсткий разрез у лимита, а не посимвольно
+    assert len(pieces) == 3
+    assert all(len(p) % 2 == 0 for p in pieces[:-1])
+
+
+# TokenBucket
+
+
+def test_bucket_allows_burst_then_limits():
+    async def main():
+        bucket = TokenBucket(rate=20, burst=3)
+        start = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = time.monotonic() - start
+        await bucket.acquire()
+        return burst, time.monotonic() - start
+
+    burst, total = asyncio.run(main())
+    assert burst < 0.02
+    assert total >= 0.04
+
+
+def test_bucket_pause():
+    async def main():
+        bucket = TokenBucket(rate=0)
+        bucket.pause(0.05)
+        assert not bucket.idle()
+        start = time.monotonic()
+        await bucket.acquire()
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.045
+
+
+def test_unlimited_bucket_is_idle():
+    assert TokenBucket(rate=0).idle()
+
+
+# DeliveryQueue
+
+
+def test_chat_order_preserved_and_long_text_split():
+    send = FakeSend()
+    queue = _queue()
+
+    async def main():
+        queue.submit(1, send, "первый")
+        assert queue.submit(1, send, "а" * 5000) == 2
+        queue.submit(1, send, "последний")
+        await queue.join(timeout=5)
+
+    asyncio.run(main())
+    texts = [text for text, _ in send.sent]
+    assert texts[0] == "первый" and texts[-1] == "последний"
+    assert "".join(texts[1:-1]) == "а" * 5000
+    assert queue.pending() == 0
+
+
+def test_retry_after_pauses_and_resends():
+    metrics.reset()
+    send = FakeSend(RetryAfter(timedelta(0)))
+    _deliver(_queue(), 1, send, "ответ")
+    assert send.sent == [("ответ", {})]
+    assert _errors() == {"telegram_flood_wait": 1}
+
+
+def test_network_error_retried_until_limit():
+    send = FakeSend(NetworkError("reset"), NetworkError("reset"))
+    _deliver(_queue(max_retries=3), 1, send, "ответ")
+    assert send.attempts == 3 and len(send.sent) == 1
+
+    send = FakeSend(*[NetworkError("reset")] * 5)
+    _deliver(_queue(max_retries=2), 1, send, "ответ")
+    assert send.attempts == 3 and send.sent == []
+
+
+def test_timeout_not_retried():
+    metrics.reset()
+    send = FakeSend(TimedOut("timed out"))
+    _deliver(_queue(max_retries=3), 1, send, "ответ")
+    assert send.attempts == 1 and send.sent == []
+    assert _errors() == {"telegram_send_timeout": 1}
+
+
+def test_unparsable_markdown_sent_as_original_text():
+    original = "Курс *Machine_Learning* [2 семестр]"
+    send = FakeSend(BadRequest("Can't parse entities: can't find end of the entity"))
+    _deliver(_queue(), 1, send, escape_markdown(original, version=1), parse_mode="Markdown")
+    assert send.sent == [(original, {})]
+
+
+def test_other_bad_request_dropped():
+    metrics.reset()
+    send = FakeSend(BadRequest("Message is too long"))
+    _deliver(_queue(), 1, send, "ответ", parse_mode="Markdown")
+    assert send.attempts == 1 and send.sent == []
+    assert _errors() == {"telegram_send": 1}
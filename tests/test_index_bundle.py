@@ -0,0 +1,104 @@
+import pytest
+
+from aith_chatbot import index_bundle, rag
+from aith_chatbot.chunking import iter_chunks
+from aith_chatbot.config import CHUNK_CACHE_DIR, QDRANT_COLLECTION
+from aith_chatbot.rag import has_index
+
+PROGRAM_MD = """# Искусственный интеллект
+
+## Поступление
+
+Вступительные испытания: экзамен по программированию и портфолио.
+
+## Учебный план
+
+Машинное обучение, глубокое обучение, MLOps.
+"""
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    path = tmp_path / "data"
+    path.mkdir()
+    (path / "ai.md").write_text(PROGRAM_MD, encoding="utf-8")
+    return path
+
+
+def test_export_and_restore(tmp_path, data_dir, fake_openai, qdrant):
+    bundle_dir = tmp_path / "bundle"
+    manifest = index_bundle.export_bundle(bundle_dir, data_dir)
+    assert manifest["count"] > 0
+    assert set(manifest["sources"]) == {"ai"}
+    # Кэш чанков — рядом с экспортируемыми данными, а не в data/ из конфига
+    assert (data_dir / CHUNK_CACHE_DIR.name).is_dir()
+
+    assert index_bundle.restore_bundle(bundle_dir, data_dir=data_dir) == manifest["count"]
+    assert has_index()
+    assert qdrant.count(QDRANT_COLLECTION).count == manifest["count"]
+    # Тот же бандл уже в коллекции — повторная загрузка не нужна
+    assert index_bundle.restore_bundle(bundle_dir, data_dir=data_dir) == 0
+
+
+def test_reexport_reuses_vectors(tmp_path, data_dir, fake_openai, qdrant):
+    bundle_dir = tmp_path / "bundle"
+    index_bundle.export_bundle(bundle_dir, data_dir)
+    calls = fake_openai.calls["embeddings"]
+    index_bundle.export_bundle(bundle_dir, data_dir)
+    assert fake_openai.calls["embeddings"] == calls
+
+
+def test_corrupted_bundle_rejected(tmp_path, data_dir, fake_openai, qdrant):
+    bundle_dir = tmp_path / "bundle"
+    index_bundle.export_bundle(bundle_dir, data_dir)
+    with open(bundle_dir / index_bundle.CHUNKS_NAME, "a", encoding="utf-8") as f:
+        f.write("\n")
+    with pytest.raises(ValueError, match="повреждён"):
+        index_bundle.load_bundle(bundle_dir)
+
+
+def test_stale_bundle_falls_back_to_build(tmp_path, data_dir, fake_openai, qdrant, monkeypatch):
+    bundle_dir = tmp_path / "bundle"
+    index_bundle.export_bundle(bundle_dir, data_dir)
+    (data_dir / "ai.md").write_text(PROGRAM_MD + "\nНовый раздел.\n", encoding="utf-8")
+
+    with pytest.raises(index_bundle.StaleBundleError):
+        index_bundle.restore_bundle(bundle_dir, data_dir=data_dir)
+
+    built = []
+    monkeypatch.setattr(
+        index_bundle, "build_index", lambda force=False, **payload: built.append((force, payload)) or 7
+    )
+    assert index_bundle.restore_or_build_index(bundle_dir, data_dir) == 7
+    current = index_bundle.sources_id(index_bundle.source_hashes(data_dir))
+    assert built == [(True, {"sources_id": current})]
+    assert not has_index()
+
+
+def test_stale_bundle_not_rebuilt_when_index_current(tmp_path, data_dir, fake_openai, qdrant, monkeypatch):
+    bundle_dir = tmp_path / "bundle"
+    index_bundle.export_bundle(bundle_dir, data_dir)
+    (data_dir / "ai.md").write_text(PROGRAM_MD + "\nНовый раздел.\n", encoding="utf-8")
+    monkeypatch.setattr(rag, "build_chunks", lambda: iter_chunks(data_dir, cache_dir=None))
+
+    # Первый старт после правки data/*.md — сборка с эмбеддингами, sources_id в payload
+    assert index_bundle.restore_or_build_index(bundle_dir, data_dir) > 0
+    calls = fake_openai.calls["embeddings"]
+    # Следующие старты с тем же устаревшим бандлом индекс не трогают
+    assert index_bundle.restore_or_build_index(bundle_dir, data_dir) == 0
+    assert fake_openai.calls["embeddings"] == calls
+    assert has_index()
+
+
+def test_qdrant_error_falls_back_to_build(tmp_path, data_dir, fake_openai, qdrant, monkeypatch):
+    from qdrant_client.http.exceptions import ResponseHandlingException
+
+    bundle_dir = tmp_path / "bundle"
+    index_bundle.export_bundle(bundle_dir, data_dir)
+
+    def unavailable(*args, **kwargs):
+        raise ResponseHandlingException(ConnectionError("connection refused"))
+
+    monkeypatch.setattr(index_bundle, "upload_chunks", unavailable)
+    monkeypatch.setattr(index_bundle, "build_index", lambda force=False, **payload: 3)
+    assert index_bundle.restore_or_build_index(bundle_dir, data_dir) == 3
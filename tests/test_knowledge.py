@@ -0,0 +1,36 @@
+import pytest
+
+from aith_chatbot.knowledge import detect_program, is_relevant
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Какие экзамены на программе AI?", "ai"),
+        ("Расскажи про программу «AI»", "ai"),
+        ("Учебный план магистратуры Искусственный интеллект", "ai"),
+        ("https://abit.itmo.ru/program/master/ai — что там изучают?", "ai"),
+        ("Что за программа AI Product?", "ai_product"),
+        ("Хочу на программу AI-продукты", "ai_product"),
+        ("Стоимость обучения на программе «AI Product»", "ai_product"),
+        ("Управление ИИ-продуктами и технологиями", "ai_product"),
+        ("Чем программа AI отличается от AI Product?", None),
+        ("Когда начинается приём документов?", None),
+    ],
+)
+def test_detect_program(text, expected):
+    assert detect_program(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Как поступить в магистратуру ИТМО?", True),
+        ("Какие дисциплины в учебном плане?", True),
+        ("Как поступить в МГУ на магистратуру?", False),
+        ("Какая завтра погода?", False),
+        ("ок", False),
+    ],
+)
+def test_is_relevant(text, expected):
+    assert is_relevant(text) is expected
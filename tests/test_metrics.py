@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from aith_chatbot import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_counter_and_histogram_rendered():
+    metrics.inc("requests_total", help_text="Запросы", kind="message")
+    metrics.inc("requests_total", kind="message")
+    metrics.observe("wait_seconds", 0.3, "Ожидание", buckets=(0.1, 0.5))
+    text = metrics.render_prometheus()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{kind="message"} 2' in text
+    assert 'wait_seconds_bucket{le="0.1"} 0' in text
+    assert 'wait_seconds_bucket{le="0.5"} 1' in text
+    assert 'wait_seconds_bucket{le="+Inf"} 1' in text
+    assert "wait_seconds_count 1" in text
+
+
+def test_label_values_escaped():
+    metrics.inc("errors_total", help_text="Ошибки\nпо этапам", stage='say "hi"\\now\nnext')
+    metrics.count_cache('a"b', hit=True)
+    text = metrics.render_prometheus()
+    assert 'errors_total{stage="say \\"hi\\"\\\\now\\nnext"} 1' in text
+    assert "# HELP errors_total Ошибки\\nпо этапам" in text
+    assert 'cache_hit_ratio{cache="a\\"b"} 1' in text
+    # Каждая метрика — одна строка
+    assert all(line.startswith(("#", "errors_total", "cache_")) for line in text.splitlines())
+
+
+def test_reset_clears_help_and_buckets():
+    metrics.observe("wait_seconds", 0.3, "Ожидание", buckets=(0.1, 0.5))
+    metrics.reset()
+    assert metrics.render_prometheus() == "\n"
+    # После сброса гистограмма с тем же именем получает новые границы
+    metrics.observe("wait_seconds", 2.0, "Ожидание", buckets=(1.0, 5.0))
+    text = metrics.render_prometheus()
+    assert 'wait_seconds_bucket{le="5"} 1' in text
+    assert 'le="0.5"' not in text
+
+
+def test_span_counts_error_once():
+    with pytest.raises(ValueError):
+        with metrics.span("completion"):
+            raise ValueError("boom")
+    text = metrics.render_prometheus()
+    assert 'stage_errors_total{stage="completion"} 1' in text
+    assert 'stage_latency_seconds_count{stage="completion"} 1' in text
+
+
+def test_span_does_not_count_cancellation():
+    with pytest.raises(asyncio.CancelledError):
+        with metrics.span("embedding"):
+            raise asyncio.CancelledError()
+    text = metrics.render_prometheus()
+    assert "stage_errors_total" not in text
+    assert 'stage_latency_seconds_count{stage="embedding"} 1' in text
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+import time
+
+from aith_chatbot import profiling
+
+
+def _busy_outsider(stop: threading.Event) -> None:
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def _profiled_work() -> None:
+    time.sleep(0.05)
+
+
+def test_profile_covers_loop_and_own_threads_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_INTERVAL_MS", 1)
+    stop = threading.Event()
+    outsider = threading.Thread(target=_busy_outsider, args=(stop,), name="outsider")
+    outsider.start()
+
+    async def main():
+        with profiling.profile_request(42, force=True, out_dir=tmp_path) as enabled:
+            assert enabled
+            await profiling.to_thread(_profiled_work)
+
+    try:
+        asyncio.run(main())
+    finally:
+        stop.set()
+        outsider.join()
+    profiling.flush(timeout=10)
+
+    stacks = (tmp_path / "42.collapsed").read_text(encoding="utf-8")
+    assert "_profiled_work" in stacks
+    assert "_busy_outsider" not in stacks
+    assert (tmp_path / "42.tracemalloc").exists()
+    assert (tmp_path / "42.alloc.txt").exists()
+
+
+def test_profile_written_off_the_loop(tmp_path, monkeypatch):
+    loop_thread = threading.get_ident()
+    writers = []
+    write_profile = profiling._write_profile
+
+    def recording_write(*args):
+        writers.append(threading.get_ident())
+        return write_profile(*args)
+
+    monkeypatch.setattr(profiling, "_write_profile", recording_write)
+    with profiling.profile_request(7, force=True, out_dir=tmp_path):
+        pass
+    profiling.flush(timeout=10)
+    assert writers and writers[0] != loop_thread
+    assert (tmp_path / "7.alloc.txt").exists()
+
+
+def test_not_sampled_without_force(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "_sample_rate", 0.0)
+    with profiling.profile_request(1, out_dir=tmp_path) as enabled:
+        assert not enabled
+    assert not any(tmp_path.iterdir())
+
+
+def test_to_thread_without_profile():
+    assert asyncio.run(profiling.to_thread(sum, [1, 2, 3])) == 6
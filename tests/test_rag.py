@@ -0,0 +1,22 @@
+import pytest
+
+from aith_chatbot.rag import _embedding_input, quantization_config, search_params
+
+
+def test_quantization_modes():
+    assert quantization_config("") is None
+    assert search_params("") is None
+    assert quantization_config("int8").scalar is not None
+    assert quantization_config("binary").binary is not None
+    assert search_params("int8").quantization.rescore
+
+
+def test_unknown_quantization_mode_rejected():
+    with pytest.raises(ValueError):
+        quantization_config("int4")
+
+
+def test_embedding_input_prefixes_headings():
+    chunk = {"text": "Экзамен по программированию.", "headings": ["Искусственный интеллект", "Поступление"]}
+    assert _embedding_input(chunk) == "Искусственный интеллект > Поступление\nЭкзамен по программированию."
+    assert _embedding_input({"text": "Без заголовков"}) == "Без заголовков"
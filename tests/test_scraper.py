@@ -0,0 +1,103 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from aith_chatbot import scraper
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Mon, 05 Oct 2026 10:00:00 GMT"
+
+
+@pytest.fixture
+def program_html():
+    return (FIXTURES / "program.html").read_text(encoding="utf-8")
+
+
+@pytest.fixture
+def program_server(program_html):
+    """Локальный HTTP-сервер со страницей программы: ETag, Last-Modified и ответ 304."""
+    body = program_html.encode("utf-8")
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):  # noqa: N802
+            requests_seen.append(dict(self.headers))
+            if self.headers.get("If-None-Match") == ETAG or self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                self.send_response(304)
+                self.send_header("ETag", ETAG)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", ETAG)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/program/master/ai", requests_seen
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_html_to_markdown_keeps_content(program_html):
+    md = scraper.html_to_markdown(program_html)
+    assert "# Искусственный интеллект" in md
+    assert "## Поступление" in md
+    assert "Вступительный экзамен по программированию" in md
+    assert "**ML-инженеров**" in md
+    assert "[сайте программы](https://ai.itmo.ru)" in md
+
+
+def test_html_to_markdown_drops_page_chrome(program_html):
+    md = scraper.html_to_markdown(program_html)
+    for noise in ("__NEXT_DATA__", "font-family", "Войти", "Бакалавриат", "© Университет ИТМО", "banner.png"):
+        assert noise not in md
+
+
+def test_builtin_parser_matches_lxml(program_html, monkeypatch):
+    pytest.importorskip("lxml")
+    monkeypatch.setattr(scraper, "HTML_PARSER", "lxml")
+    expected = scraper.html_to_markdown(program_html)
+    monkeypatch.setattr(scraper, "HTML_PARSER", "html.parser")
+    assert scraper.html_to_markdown(program_html) == expected
+
+
+def test_run_scraper_conditional_requests(tmp_path, program_server):
+    url, requests_seen = program_server
+    programs = {"ai": url}
+
+    assert scraper.run_scraper(programs=programs, data_dir=tmp_path) == {"ai": scraper.CHANGED}
+    md_path = tmp_path / "ai.md"
+    md = md_path.read_text(encoding="utf-8")
+    assert "## Поступление" in md
+    mtime = md_path.stat().st_mtime_ns
+    manifest = scraper.load_manifest(tmp_path)
+    assert manifest == {
+        "ai": {
+            "url": url,
+            "etag": ETAG,
+            "last_modified": LAST_MODIFIED,
+            "sha256": scraper.content_hash(md),
+        }
+    }
+    assert "If-None-Match" not in requests_seen[0]
+
+    # Повторный запуск: условный запрос, 304, файл не перезаписан
+    assert scraper.run_scraper(programs=programs, data_dir=tmp_path) == {"ai": scraper.NOT_MODIFIED}
+    assert requests_seen[1]["If-None-Match"] == ETAG
+    assert requests_seen[1]["If-Modified-Since"] == LAST_MODIFIED
+    assert md_path.stat().st_mtime_ns == mtime
+    assert scraper.load_manifest(tmp_path) == manifest